@@ -4,13 +4,12 @@ import traceback
 from io import BytesIO
 import streamlit as st
 import fitz  # PyMuPDF
-import re
 import pandas as pd
-from pypdf import PdfReader
-from pypdf.errors import FileNotDecryptedError
 from streamlit import session_state
 from collections import Counter  # <-- Add this import for the Counter class
-from utils import helpers, init_session_states, page_config
+from utils import helpers, init_session_states, llm, metrics, page_config, pipeline, preview
+from utils.document import get_document
+from utils.jobs import get_queue
 from dotenv import load_dotenv
 import openai
 
@@ -28,6 +27,9 @@ page_config.set()
 # Initialize session states
 init_session_states.init()
 
+# Time every instrumented stage of this run
+run = metrics.start_run()
+
 # ---------- HEADER ----------
 st.title("📄 PDF WorkDesk with Text Extraction & Contextual Analysis")
 st.write(
@@ -38,32 +40,6 @@ st.write(
 st.subheader("Upload Your PDF File")
 uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 
-# ---------- FIXED parse_page_numbers function -----------
-@st.cache_data
-def parse_page_numbers(page_numbers_str):
-    parts = page_numbers_str.split(",")
-    parsed_page_numbers = []
-    for part in parts:
-        part = part.strip()
-        if "-" in part:
-            start, end = map(int, part.split("-"))
-            parsed_page_numbers.extend(range(start, end + 1))
-        else:
-            parsed_page_numbers.append(int(part))
-    return [i - 1 for i in parsed_page_numbers]
-
-# Function to extract text from PDF
-def extract_text(reader: PdfReader.pages, page_numbers_str: str = "all", mode: str = "plain") -> str:
-    text = ""
-    if page_numbers_str == "all":
-        for page in reader.pages:
-            text = text + " " + page.extract_text(extraction_mode=mode)
-    else:
-        pages = parse_page_numbers(page_numbers_str)
-        for page in pages:
-            text = text + " " + reader.pages[page].extract_text()
-    return text
-
 # Function to convert PDF to Markdown
 def pdf_to_markdown(pdf_document):
     markdown_text = ""
@@ -72,122 +48,93 @@ def pdf_to_markdown(pdf_document):
         markdown_text += page.get_text("markdown")
     return markdown_text
 
-# Function to query OpenAI for relevant data extraction
-def query_openai(text, term):
-    # Define the prompt template for OpenAI to extract information about each term
-    prompt = f"""
-    Pull the following in a table with the following columns:
-    Term | Response | Page number
-    
-    Here are the 20 things we need with the response options in parentheses:
-    Plan name (free text)
-    Trustee (free text)
-    EIN (integers)
-    Year End  (date)
-    Entity Type (C corp, S corp, non profit, partnership, LLC taxed as a s corp, LLC taxed as a c corp, LLC taxed as sole proprietor, Limited Liability Partnership, Sole Proprietorship, union, government agency, other)   
-    Entity State (free text)
-    Is it a safe harbor (No, Yes - safe harbor match, Yes - nonelective contribution, Yes - QACA safe harbor match, Yes - enhanced safe harbor match, Yes - QACA nonelective contribution)
-    Vesting(100% Vested, 2 - 6 Year Graded, 1 - 5 Year Graded, 2 Year 50/50, 1 - 4 Year Graded, 3 Year Cliff, 2 Year Cliff, 1 Year Cliff)
-    Profit sharing vesting (100% Vested, 2 - 6 Year Graded, 1 - 5 Year Graded, 2 Year 50/50, 1 - 4 Year Graded, 3 Year Cliff, 2 Year Cliff, 1 Year Cliff)
-    Plan Type (free text)
-
-    {text}
-    """
-    
-    try:
-        # Query OpenAI API to extract relevant data based on the term
-        response = openai.Completion.create(
-            model="gpt-4",  # Use a GPT model (adjust for GPT-4 or other models if necessary)
-            prompt=prompt,
-            max_tokens=1500,  # Set max tokens for the response
-            temperature=0.5,  # Control randomness
-            n=1,
-            stop=None
-        )
-        # Return the extracted response from OpenAI
-        return response.choices[0].text.strip()
-    except Exception as e:
-        # Handle errors in case of issues with the OpenAI API
-        print(f"Error querying OpenAI: {e}")
-        return None
-
-# Function to extract relevant information from the PDF based on terms
-def extract_relevant_information(pdf_reader, terms):
-    info_data = {term: None for term in terms}  # Initialize dictionary to store term info
-
-    # Iterate over each page of the PDF and extract the relevant data
-    for page_num, page in enumerate(pdf_reader.pages):
-        text = page.extract_text()  # Extract text from the current page
-        if text:
-            # Loop over each term and extract information using OpenAI
-            for term in terms:
-                if info_data[term] is None:  # Only process if the term hasn't been found yet
-                    extracted_info = query_openai(text, term)  # Get information from OpenAI
-                    if extracted_info:  # If OpenAI returned something
-                        info_data[term] = [term, extracted_info, page_num + 1]  # Save term, data, and page number
-
-    # Return the data in a structured format: [[term, extracted_info, page_number], ...]
-    return [
-        [term, info_data[term][1] if info_data[term] else "", info_data[term][2] if info_data[term] else ""]
-        for term in terms
-    ]
-
 # ---------- MAIN SECTION ----------
 try:
     if uploaded_file is not None:
-        # Read the uploaded PDF
-        try:
-            pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-            pdf_reader = PdfReader(uploaded_file)
-            session_state["password"], session_state["is_encrypted"] = "", False
-        except FileNotDecryptedError:
+        # Read the uploaded PDF, parsed once per upload and reused across reruns
+        document = get_document(uploaded_file)
+        doc_hash = document.digest
+        pdf_document = document.fitz
+        if pdf_document.needs_pass:
             pdf_document = "password_required"
             st.error("PDF is password protected. Please enter the password to proceed.")
+        else:
+            session_state["password"], session_state["is_encrypted"] = "", False
 
         # ---------- PDF OPERATIONS ----------
         if pdf_document != "password_required" and pdf_document:
 
-            # Extract text from PDF
-            extracted_text = ""
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document.load_page(page_num)
-                extracted_text += page.get_text("text")  # Basic text extraction
-
-            # Clean the extracted text
-            def clean_text(text):
-                text = text.lower()
-                text = re.sub(r'[^\w\s]', '', text)
-                text = re.sub(r'\s+', ' ', text).strip()
-                return text
-
-            cleaned_text = clean_text(extracted_text)
-
             # Define the terms to extract
             terms_to_extract = [
                 "Plan name", "Trustee", "EIN", "Year End", "Entity Type", "Entity State",
                 "Is it a safe harbor", "Vesting", "Profit sharing vesting", "Plan Type"
             ]
 
-            # Extract information matching specific terms using OpenAI
-            extracted_info = extract_relevant_information(pdf_reader, terms_to_extract)
+            # Extract with the regex engine first, and OpenAI only for what it misses.
+            # This runs as a background job, so reruns poll it rather than redo it;
+            # one that failed or was cancelled is only run again from its Retry button.
+            extraction_job = helpers.submit_extraction(document, terms_to_extract)
 
             # Display the extracted information in a table
             with st.container():
                 col1, col2 = st.columns([2, 1])
                 with col1:
                     st.subheader("Extracted Information")
-                    info_df = pd.DataFrame(extracted_info, columns=["Term", "Response", "Page Number"])
-                    st.dataframe(info_df)
+                    job = helpers.show_job(
+                        extraction_job,
+                        "Extracting terms",
+                        retry=lambda: helpers.submit_extraction(
+                            document, terms_to_extract, resubmit=True
+                        ),
+                    )
+                    if job.status == "done":
+                        extracted_info, hybrid_stats = pipeline.from_json(
+                            get_queue().result(extraction_job)
+                        )
+                        usage = hybrid_stats.usage
+                        info_df = pipeline.to_dataframe(extracted_info)
+                        st.dataframe(info_df)
+                        st.caption(
+                            f"Regex answered {hybrid_stats.regex_terms} of {len(terms_to_extract)} terms; "
+                            f"OpenAI searched {hybrid_stats.pages_sent} of {hybrid_stats.pages_total} pages "
+                            f"for the other {hybrid_stats.llm_terms}"
+                        )
+                        st.caption(
+                            f"{usage.calls} OpenAI calls, {usage.total_tokens} tokens "
+                            f"({usage.prompt_tokens} prompt / {usage.completion_tokens} completion), "
+                            f"{usage.cache_hits} pages answered from cache"
+                        )
+                        if hybrid_stats.revision_of:
+                            recomputed = [r.term for r in extracted_info if r.recomputed]
+                            st.caption(
+                                f"Revision of an earlier upload: {hybrid_stats.pages_changed} of "
+                                f"{hybrid_stats.pages_total} pages changed; recomputed "
+                                f"{', '.join(recomputed) or 'no terms'}, the rest carried over"
+                            )
+                        cache_stats = llm.get_default_cache().stats()
+                        st.caption(
+                            f"LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+                            f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB)"
+                        )
                 with col2:
                     st.subheader("Document Preview")
-                    preview_area = st.empty()
-                    preview_area.markdown('<div style="height:400px; overflow-y:scroll; width:300px;">', unsafe_allow_html=True)
-                    for page_num in range(pdf_document.page_count):
-                        page = pdf_document.load_page(page_num)
-                        pix = page.get_pixmap()
-                        img_data = pix.tobytes("png")
-                        preview_area.image(img_data, caption=f"Page {page_num + 1}", use_column_width=True)
-                    preview_area.markdown("</div>", unsafe_allow_html=True)
+                    preview.show_preview(pdf_document, doc_hash)
+
+            # ---------- EXPORT ----------
+            # Heavy operations run as background jobs; results are kept per document
+            with st.expander("Compress, reduce images or convert to Word"):
+                password = session_state["password"]
+                col1, col2, col3 = st.columns(3)
+                object_streams = col1.checkbox("Pack object streams")
+                if col1.button("Compress"):
+                    helpers.submit_compress(document.data, password, object_streams)
+                quality = col2.slider("JPEG quality", 10, 95, 50)
+                if col2.button("Reduce image quality"):
+                    helpers.submit_reduce_image_quality(document.data, quality, password)
+                pages = helpers.select_pages(col3, "word_pages") or "all"
+                if col3.button("Convert to Word"):
+                    helpers.submit_convert_pdf_to_word(document.data, password, pages)
+                helpers.show_document_jobs(doc_hash, password)
 
         else:
             st.error("Unable to process the PDF. It may be password protected.")
@@ -195,3 +142,6 @@ try:
 except Exception as e:
     st.error(f"An error occurred: {e}")
     st.write(traceback.format_exc())
+
+metrics.show_run(run)
+metrics.finish_run()
@@ -0,0 +1,244 @@
+"""Headless term extraction over directories of PDFs.
+
+    python batch_extract.py plans/ "archive/**/*.pdf" -o results.csv --workers 8
+
+Results are appended to the output as each file finishes (.csv, .jsonl, or a
+directory of .parquet parts). A journal next to the output records finished
+files, so re-running the same command resumes where a crashed run stopped.
+
+With the llm and hybrid engines the workers split OPENAI_TOKENS_PER_MINUTE
+and OPENAI_MAX_CONCURRENCY evenly, and there are at most as many workers as
+concurrent requests allowed.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Literal, Optional, Set
+
+import pandas as pd
+
+Engine = Literal["regex", "llm", "hybrid"]
+COLUMNS = ["File", "Term", "Response", "Page Number"]
+
+# Request scheduler of an llm or hybrid worker process, with its share of the
+# OpenAI rate limits; a scheduler per file would reset the token budget
+_scheduler = None
+
+
+def _init_worker(workers: int) -> None:
+    global _scheduler
+    from utils import llm
+
+    _scheduler = llm.default_scheduler(workers)
+
+
+def find_pdfs(inputs: Iterable[str]) -> List[str]:
+    files: Dict[str, None] = {}
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            matches = sorted(str(p) for p in path.rglob("*") if p.suffix.lower() == ".pdf")
+        elif path.is_file():
+            matches = [item]
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+        files.update(dict.fromkeys(os.path.abspath(m) for m in matches))
+    return list(files)
+
+
+def extract_file(path: str, engine: Engine) -> dict:
+    """Worker entry point: extract every term from one PDF."""
+    start = time.perf_counter()
+    record = {"file": path, "status": "ok", "rows": [], "error": None, "tokens": 0}
+    try:
+        if engine == "regex":
+            import fitz  # PyMuPDF
+
+            from utils.regex_extraction import (
+                PageTextIndex,
+                extract_terms_from_text,
+                terms_to_extract,
+            )
+
+            with fitz.open(path) as doc:
+                rows = extract_terms_from_text(
+                    PageTextIndex.from_document(doc), terms_to_extract
+                )
+        elif engine == "llm":
+            from pypdf import PdfReader
+
+            from utils import llm
+
+            stats = llm.UsageStats()
+            rows = llm.extract_relevant_information(
+                PdfReader(path), llm.TERMS, stats, scheduler=_scheduler
+            )
+            record["tokens"] = stats.total_tokens
+            errors = stats.errors
+        else:
+            from utils import pipeline
+            from utils.document import PdfDocument
+            from utils.regex_extraction import terms_to_extract
+
+            stats = pipeline.HybridStats()
+            results = pipeline.extract_hybrid(
+                PdfDocument(Path(path).read_bytes()),
+                list(terms_to_extract),
+                stats=stats,
+                scheduler=_scheduler,
+            )
+            rows = [[r.term, r.value, r.page] for r in results]
+            record["tokens"] = stats.usage.total_tokens
+            errors = stats.usage.errors
+        if engine != "regex" and errors:
+            # Journaled as an error, so a resumed run retries the file
+            raise RuntimeError(f"{len(errors)} OpenAI requests failed, first: {errors[0]}")
+        record["rows"] = [[path, term, str(value), str(page)] for term, value, page in rows]
+    except Exception as e:
+        record["status"], record["error"] = "error", f"{type(e).__name__}: {e}"
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+class ResultWriter:
+    """Appends rows to the output and marks files done in the journal.
+
+    Rows are always written before the journal entry, so a crash can at worst
+    repeat the last file, never lose one.
+    """
+
+    def __init__(self, output: Path, flush_every: int = 1):
+        self.output = output
+        self.format = output.suffix.lower().lstrip(".")
+        if self.format not in ("csv", "jsonl", "parquet"):
+            raise ValueError(f"Unsupported output format: {output.suffix}")
+        self.journal = output.with_name(output.name + ".journal.jsonl")
+        self.flush_every = 50 if self.format == "parquet" else flush_every
+        self._rows: List[list] = []
+        self._entries: List[dict] = []
+        self._parts = 0
+
+    def done_files(self) -> Set[str]:
+        if not self.journal.exists():
+            return set()
+        done = set()
+        with self.journal.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:  # Torn final line from a crash
+                    continue
+                if entry["status"] == "ok":
+                    done.add(entry["file"])
+        return done
+
+    def reset(self) -> None:
+        self.journal.unlink(missing_ok=True)
+        if self.format == "parquet":
+            for part in self.output.glob("part-*.parquet") if self.output.is_dir() else []:
+                part.unlink()
+        else:
+            self.output.unlink(missing_ok=True)
+
+    def add(self, record: dict) -> None:
+        self._rows.extend(record["rows"])
+        self._entries.append(
+            {k: record[k] for k in ("file", "status", "error", "seconds", "tokens")}
+        )
+        if len(self._entries) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._entries:
+            return
+        if self._rows:
+            df = pd.DataFrame(self._rows, columns=COLUMNS)
+            if self.format == "csv":
+                df.to_csv(self.output, mode="a", header=not self.output.exists(), index=False)
+            elif self.format == "jsonl":
+                with self.output.open("a") as f:
+                    f.write(df.to_json(orient="records", lines=True))
+            else:
+                self.output.mkdir(parents=True, exist_ok=True)
+                name = f"part-{time.time_ns()}-{self._parts:05d}.parquet"
+                df.to_parquet(self.output / f".{name}", index=False)
+                (self.output / f".{name}").rename(self.output / name)
+                self._parts += 1
+        with self.journal.open("a") as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry) + "\n")
+        self._rows, self._entries = [], []
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument(
+        "-o", "--output", required=True, help="results.csv, results.jsonl or results.parquet"
+    )
+    parser.add_argument("--engine", choices=["regex", "llm", "hybrid"], default="regex")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the journal and start over"
+    )
+    args = parser.parse_args(argv)
+
+    writer = ResultWriter(Path(args.output))
+    if args.restart:
+        writer.reset()
+
+    files = find_pdfs(args.inputs)
+    done = writer.done_files()
+    todo = [f for f in files if f not in done]
+    print(
+        f"{len(files)} PDFs found, {len(files) - len(todo)} already done, "
+        f"{len(todo)} to process",
+        file=sys.stderr,
+    )
+
+    workers, initializer = args.workers or 1, None
+    if args.engine != "regex":
+        from utils import llm
+
+        # More workers than concurrent requests would only wait on each other
+        workers, initializer = min(workers, llm.MAX_CONCURRENCY), _init_worker
+
+    seconds, failed, start = [], 0, time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=initializer, initargs=(workers,)
+        ) as pool:
+            futures = [pool.submit(extract_file, f, args.engine) for f in todo]
+            for i, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.add(record)
+                seconds.append(record["seconds"])
+                failed += record["status"] != "ok"
+                status = record["status"] if record["status"] == "ok" else record["error"]
+                print(
+                    f"[{i}/{len(todo)}] {record['seconds']:7.2f}s  {record['file']}  {status}",
+                    file=sys.stderr,
+                )
+    finally:
+        writer.flush()
+
+    if seconds:
+        timings = pd.Series(seconds)
+        print(
+            f"Processed {len(seconds)} files ({failed} failed) in "
+            f"{time.perf_counter() - start:.1f}s; per file: mean {timings.mean():.2f}s, "
+            f"p50 {timings.median():.2f}s, p95 {timings.quantile(0.95):.2f}s, "
+            f"max {timings.max():.2f}s",
+            file=sys.stderr,
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Peak memory of image extraction: bytes-keyed dict vs streaming to disk.
+
+    python -m benchmarks.bench_extract_images --pages 200
+    python -m benchmarks.bench_extract_images --pdf scans.pdf
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import fitz  # PyMuPDF
+from PIL import Image
+from pypdf import PdfReader
+
+from utils.images import save_images
+
+
+def synthetic_pdf(pages: int, size: int = 600) -> bytes:
+    """Pages with one distinct noise "scan" each and a logo shared by all."""
+    doc = fitz.open()
+    logo = BytesIO()
+    Image.new("RGB", (200, 80), (20, 60, 120)).save(logo, "PNG")
+    for _ in range(pages):
+        scan = BytesIO()
+        Image.frombytes("L", (size, size), os.urandom(size * size)).save(scan, "PNG")
+        page = doc.new_page()
+        page.insert_image(fitz.Rect(36, 36, 236, 116), stream=logo.getvalue())
+        page.insert_image(fitz.Rect(36, 150, 556, 670), stream=scan.getvalue())
+    return doc.tobytes()
+
+
+def legacy(reader: PdfReader) -> int:
+    # The previous helpers.extract_images: every image's bytes kept as a dict key
+    images = {}
+    for page in reader.pages:
+        images |= {image.data: image.name for image in page.images}
+    return len(images)
+
+
+def measure(label: str, fn) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:>10} {count:>7} {elapsed:>8.2f} {peak / 2**20:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="PDF to benchmark (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    pdf = open(args.pdf, "rb").read() if args.pdf else synthetic_pdf(args.pages)
+    pages = range(len(PdfReader(BytesIO(pdf)).pages))
+    print(f"{len(pages)} pages, {len(pdf) / 2**20:.1f} MB")
+    print(f"{'method':>10} {'images':>7} {'seconds':>8} {'peak (MB)':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        measure("dict", lambda: legacy(PdfReader(BytesIO(pdf))))
+        measure(
+            "directory",
+            lambda: len(save_images(PdfReader(BytesIO(pdf)), pages, f"{tmp}/images")),
+        )
+        measure(
+            "zip",
+            lambda: len(save_images(PdfReader(BytesIO(pdf)), pages, f"{tmp}/images.zip")),
+        )
+
+
+if __name__ == "__main__":
+    main()
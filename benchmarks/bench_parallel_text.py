@@ -0,0 +1,58 @@
+"""Scaling curve for parallel page-text extraction.
+
+    python -m benchmarks.bench_parallel_text --pages 400 --max-workers 8
+    python -m benchmarks.bench_parallel_text --pdf plan.pdf --mode layout
+"""
+
+import argparse
+import os
+import time
+
+import fitz  # PyMuPDF
+
+from utils.parallel_text import extract_pages_parallel
+
+
+def synthetic_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    line = "The Employer adopts this plan subject to the elections below. " * 2
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_textbox(
+            fitz.Rect(36, 36, 576, 756),
+            f"SECTION {page_num}\n" + "\n".join(line for _ in range(60)),
+            fontsize=8,
+        )
+    return doc.tobytes()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="PDF to benchmark (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--mode", choices=["plain", "layout"], default="plain")
+    parser.add_argument("--engine", choices=["pypdf", "pymupdf"], default="pypdf")
+    args = parser.parse_args()
+
+    pdf = open(args.pdf, "rb").read() if args.pdf else synthetic_pdf(args.pages)
+    pages = list(range(fitz.open(stream=pdf, filetype="pdf").page_count))
+
+    print(f"{len(pages)} pages, engine={args.engine}, mode={args.mode}")
+    print(f"{'workers':>7} {'seconds':>8} {'pages/s':>8} {'speedup':>8}")
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        start = time.perf_counter()
+        extract_pages_parallel(pdf, pages, args.mode, workers, args.engine)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(
+            f"{workers:>7} {elapsed:>8.2f} {len(pages) / elapsed:>8.1f} "
+            f"{baseline / elapsed:>7.2f}x"
+        )
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
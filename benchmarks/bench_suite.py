@@ -0,0 +1,324 @@
+"""Time and memory of the extraction and manipulation paths on synthetic plans.
+
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --pages 10 100 500 2000 --variants text
+    python -m benchmarks.bench_suite --cases compress_pdf convert_pdf_to_word --repeat 3
+
+Fixtures come from `benchmarks.fixtures`. Every case runs in a fresh
+process, so caches start cold and peak RSS belongs to that case alone. Each
+run is appended to a JSON-lines history, and cases that slowed down by more
+than --tolerance since the last run on this machine are flagged.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import openai
+
+from benchmarks.fixtures import DEFAULT_DIR, fixture_path
+from utils import llm
+from utils.compression import compress
+from utils.document import PdfDocument
+from utils.helpers import extract_images, extract_text
+from utils.images import recompress_images
+from utils.llm_cache import ResponseCache
+from utils.regex_extraction import extract_terms_from_text, terms_to_extract
+from utils.scheduler import RequestScheduler
+from utils.stub_server import StubCompletionServer
+from utils.tables import iter_tables
+from utils.word import convert_to_docx
+
+HISTORY = Path(__file__).with_name("history.jsonl")
+PASSWORD = "bench"
+# Cases faster than this are too noisy to flag
+MIN_FLAG_SECONDS = 0.05
+
+# variant -> (fixture kind, password)
+VARIANTS = {
+    "text": ("text", None),
+    "images": ("images", None),
+    "encrypted": ("text", PASSWORD),
+}
+
+
+def _terms(document) -> dict:
+    rows = extract_terms_from_text(document.fitz, terms_to_extract)
+    return {"found": sum(value != "Not Found" for _, value, _ in rows)}
+
+
+def _text(mode: str) -> Callable[..., dict]:
+    def run(document) -> dict:
+        return {"chars": len(extract_text(document.reader, "all", mode))}
+
+    return run
+
+
+def _tables(document) -> dict:
+    # The strategies extract_tables starts with
+    tables = list(iter_tables(document, range(document.page_count), "text", "text"))
+    return {"tables": len(tables)}
+
+
+def _images(document) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        return {"images": len(extract_images(document.reader, "all", tmp))}
+
+
+def _compress(document) -> dict:
+    data = compress(document.source, document.password)[0]
+    return {"ratio": round(len(data) / len(document.data), 3)}
+
+
+def _reduce_images(document) -> dict:
+    data = recompress_images(document.source, 50, document.password)[0]
+    return {"ratio": round(len(data) / len(document.data), 3)}
+
+
+def _word(document) -> dict:
+    data = convert_to_docx(document.source, document.digest, document.password)
+    return {"bytes": len(data)}
+
+
+def _llm(document) -> dict:
+    server = StubCompletionServer().start()
+    openai.api_base, openai.api_key = server.api_base, "stub"
+    stats = llm.UsageStats()
+    try:
+        rows = llm.extract_relevant_information(
+            document.reader,
+            llm.TERMS,
+            stats=stats,
+            # No token budget: waiting on it would swamp the time of our own code
+            scheduler=RequestScheduler(max_concurrency=llm.MAX_CONCURRENCY),
+            cache=ResponseCache(":memory:"),
+        )
+    finally:
+        server.stop()
+    return {
+        "answered": sum(bool(value) for _, value, _ in rows),
+        "calls": stats.calls,
+        "tokens": stats.total_tokens,
+    }
+
+
+# name -> (function, variants it runs on)
+CASES: Dict[str, tuple] = {
+    "extract_terms_from_text": (_terms, ("text", "images", "encrypted")),
+    "extract_text_plain": (_text("plain"), ("text", "images", "encrypted")),
+    "extract_text_layout": (_text("layout"), ("text", "encrypted")),
+    "extract_tables": (_tables, ("text", "encrypted")),
+    "extract_images": (_images, ("images",)),
+    "compress_pdf": (_compress, ("text", "images", "encrypted")),
+    "reduce_image_quality": (_reduce_images, ("images",)),
+    "convert_pdf_to_word": (_word, ("text", "images", "encrypted")),
+    "extract_relevant_information": (_llm, ("text",)),
+}
+
+
+def _cpu_seconds() -> float:
+    # Pool workers only count once reaped; pools left to wind down are missed
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak_rss() -> int:
+    """Start peak RSS afresh from here, returning the current RSS in KB.
+
+    Importing the app peaks above what small cases use, so the lifetime peak
+    would hide them. Linux lets a process reset its own high-water mark;
+    elsewhere the peak is measured against the import peak instead.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _status_kb("VmRSS")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _peak_rss() -> int:
+    return _status_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(case: str, path: str, password: Optional[str], trace_memory: bool) -> dict:
+    """Run one case in this (fresh) process and measure it."""
+    func = CASES[case][0]
+    base_rss = _reset_peak_rss()
+    if trace_memory:
+        tracemalloc.start()
+    start, cpu = time.perf_counter(), _cpu_seconds()
+
+    document = PdfDocument.from_path(Path(path), password)
+    detail = func(document)
+    document.close()
+
+    result = {
+        "seconds": time.perf_counter() - start,
+        "cpu_seconds": _cpu_seconds() - cpu,
+        # Peak RSS above the idle, fully imported process
+        "peak_mb": (_peak_rss() - base_rss) / 1024,
+        "detail": detail,
+    }
+    if trace_memory:
+        result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+    return result
+
+
+def _spawn(case: str, path: Path, password: Optional[str], trace: bool, timeout: float) -> dict:
+    command = [sys.executable, "-m", "benchmarks.bench_suite", "--run-case", case]
+    command += ["--fixture", str(path)]
+    if password:
+        command += ["--password", password]
+    if trace:
+        command.append("--trace-memory")
+    done = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    if done.returncode != 0:
+        return {"error": done.stderr.strip().splitlines()[-1] if done.stderr else "failed"}
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def measure(
+    case: str, path: Path, password: Optional[str], repeat: int, trace: bool, timeout: float
+) -> dict:
+    """Median time of `repeat` runs, their largest peak, and optionally traced memory."""
+    runs = [_spawn(case, path, password, False, timeout) for _ in range(repeat)]
+    if errors := [r["error"] for r in runs if "error" in r]:
+        return {"error": errors[0]}
+
+    result = {
+        "seconds": statistics.median(r["seconds"] for r in runs),
+        "cpu_seconds": statistics.median(r["cpu_seconds"] for r in runs),
+        "peak_mb": max(r["peak_mb"] for r in runs),
+        "detail": runs[-1]["detail"],
+    }
+    if trace:
+        # A separate run, as tracemalloc slows Python-heavy cases several times
+        traced = _spawn(case, path, password, True, timeout)
+        result["traced_peak_mb"] = traced.get("traced_peak_mb")
+    return result
+
+
+def _commit() -> Optional[str]:
+    try:
+        done = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return done.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(history: Path, host: str) -> Dict[tuple, dict]:
+    """Results of the last recorded run on `host`, by (case, fixture)."""
+    if not history.exists():
+        return {}
+    last = None
+    with open(history) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("host") == host:
+                last = entry
+    if last is None:
+        return {}
+    return {(r["case"], r["fixture"]): r for r in last["results"] if "seconds" in r}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="also run under tracemalloc")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds per run")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_DIR)
+    parser.add_argument("--history", type=Path, default=HISTORY)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="flag slowdowns above this")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--fixture", help=argparse.SUPPRESS)
+    parser.add_argument("--password", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.fixture, args.password, args.trace_memory)))
+        return
+
+    host = platform.node()
+    previous = _previous(args.history, host)
+    results: List[dict] = []
+    regressions = 0
+    print(
+        f"{'case':<30} {'fixture':<16} {'seconds':>8} {'cpu':>8} {'peak (MB)':>10} "
+        f"{'traced (MB)':>11} {'vs last':>8}"
+    )
+    for variant in args.variants:
+        kind, password = VARIANTS[variant]
+        for pages in args.pages:
+            path = fixture_path(pages, kind, password, directory=args.fixtures)
+            fixture = f"{variant}-{pages}p"
+            for case in args.cases:
+                if variant not in CASES[case][1]:
+                    continue
+                result = {"case": case, "fixture": fixture, "pages": pages}
+                result |= measure(
+                    case, path, password, args.repeat, args.trace_memory, args.timeout
+                )
+                results.append(result)
+                if "error" in result:
+                    print(f"{case:<30} {fixture:<16} failed: {result['error']}")
+                    continue
+
+                change = ""
+                if (last := previous.get((case, fixture))) and last["seconds"] > 0:
+                    ratio = result["seconds"] / last["seconds"] - 1
+                    change = f"{ratio:+.0%}"
+                    if ratio > args.tolerance and result["seconds"] >= MIN_FLAG_SECONDS:
+                        result["regression"] = True
+                        regressions += 1
+                        change += " !"
+                traced = result.get("traced_peak_mb")
+                print(
+                    f"{case:<30} {fixture:<16} {result['seconds']:>8.2f} "
+                    f"{result['cpu_seconds']:>8.2f} {result['peak_mb']:>10.1f} "
+                    f"{'' if traced is None else f'{traced:.1f}':>11} {change:>8}"
+                )
+
+    entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "host": host,
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.history, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Appended to {args.history}; {regressions} regression(s) flagged")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
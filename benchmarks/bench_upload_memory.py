@@ -0,0 +1,94 @@
+"""Memory of opening a large upload: in-memory bytes vs spooled and memory-mapped.
+
+    python -m benchmarks.bench_upload_memory --pdf big.pdf --workers 2
+
+Each mode runs in a fresh process that opens the upload the way the app
+does, builds every parser and reads some text, then opens it in a worker
+pool. Anonymous memory is private to a process; the file-backed pages of a
+mapping are page cache, shared by every process mapping the same file, and
+also show up in peak RSS.
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _worker_anon(pages: list) -> float:
+    from utils import parallel_text
+
+    parallel_text._extract_pages(pages, "plain", "pypdf")
+    return _status_mb("RssAnon")
+
+
+def run(mode: str, path: str, workers: int) -> None:
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+    from utils import document, parallel_text
+    from utils.workers import process_pool
+
+    with open(path, "rb") as f:
+        # Stands in for the copy Streamlit holds for every upload
+        record = UploadedFileRec("upload", "plan.pdf", "application/pdf", f.read())
+    upload = UploadedFile(record, None)
+
+    start = time.perf_counter()
+    if mode == "bytes":
+        doc = document.PdfDocument(upload.getvalue())
+    else:
+        document.SPOOL_MIN_BYTES = 0
+        doc = document.get_document(upload)
+
+    pages = range(min(doc.page_count, 20))
+    for i in pages:
+        doc.fitz[i].get_text()
+        doc.reader.pages[i].extract_text()
+    doc.plumber.pages[0].extract_text()
+    anon, mapped = _status_mb("RssAnon"), _status_mb("RssFile")
+
+    # What each worker holds privately once it has opened the document
+    initargs = (doc.source, "pypdf", None)
+    with process_pool(workers, parallel_text._open, initargs) as pool:
+        worker_anon = max(pool.map(_worker_anon, [list(pages)] * workers))
+    elapsed = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{mode:>8} {elapsed:>8.2f} {peak:>10.0f} {anon:>10.0f} "
+        f"{mapped:>10.0f} {worker_anon:>12.0f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", required=True, help="a multi-hundred-MB PDF")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--mode", choices=["bytes", "spooled"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.pdf, args.workers)
+        return
+
+    print(
+        f"{'mode':>8} {'seconds':>8} {'peak (MB)':>10} {'anon (MB)':>10} "
+        f"{'file (MB)':>10} {'worker (MB)':>12}"
+    )
+    for mode in ("bytes", "spooled"):
+        command = [sys.executable, "-m", "benchmarks.bench_upload_memory"]
+        command += ["--pdf", args.pdf, "--workers", str(args.workers), "--mode", mode]
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
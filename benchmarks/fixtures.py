@@ -0,0 +1,178 @@
+"""Synthetic 401(k) adoption agreements for benchmarks.
+
+Documents are generated from a seed, so the same arguments always give the
+same pages (and, unencrypted, the same bytes). The elections `terms_to_extract` looks for sit under their
+section headings, spread through the document as in a real agreement; the
+pages between hold boilerplate and ruled election tables.
+
+    python -m benchmarks.fixtures --pages 500 --kind images --password bench
+"""
+
+import argparse
+import os
+import random
+from io import BytesIO
+from pathlib import Path
+from typing import Literal, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+Kind = Literal["text", "images"]
+
+# Part of every fixture's file name; bump it when the generated pages change
+VERSION = 1
+DEFAULT_DIR = Path(
+    os.getenv("BENCH_FIXTURES", Path.home() / ".cache" / "pdf-workdesk" / "fixtures")
+)
+
+# Where each section starts, as a fraction of the document, and its elections
+SECTIONS = [
+    (0.0, "Plan Name/Effective Date", "Plan name: Acme Manufacturing 401(k) Plan\n"
+     "Trustee: First National Trust Company\nEffective date: 01/01/2024\n"),
+    (0.02, "EMPLOYER INFORMATION", "Employer: Acme Manufacturing, Inc.\n"
+     "EIN: 12-3456789\nentity type: S corp\nstate: OH\n"),
+    (0.05, "PLAN INFORMATION", "Plan Type: 401(k)\nPlan Year: the 12 month period ending "
+     "on the fiscal year end: 12/31\n"),
+    (0.15, "Compensation", "Definition of Statutory Compensation:\nW-2 Compensation\n"),
+    (0.25, "Eligibility", "Entry Dates for Plan Participation\n(select one)\n"
+     "First day of each calendar quarter\nAge Requirement\n(years)\n21\n"
+     "Match Entry date\n(select one)\nFirst day of each month\n"
+     "Match Minimum age\n(years)\n21\nProfit share entry date\n(select one)\n"
+     "First day of the Plan Year\nProfit Share Minimum Age\n(years)\n18\n"),
+    (0.4, "CONTRIBUTIONS", "Participants modify/start/stop Elective Deferrals\n"
+     "(select one)\nFirst day of each payroll period\n"
+     "Safe harbor contributions are permitted\n(select one)\n Yes\n"
+     "Period for determining the amount of an allocation\n(select one)\n"
+     "Each payroll period\n"),
+    (0.6, "VESTING", "Matching Contributions Vesting Schedule\n(select one)\n"
+     "100% Vested\nNon-Elective Contributions Vesting Schedule\n(select one)\n"
+     "2 - 6 Year Graded\nElapsed Vesting: False\n"),
+]
+
+WORDS = (
+    "the employer plan participant contribution account vesting service year "
+    "eligible compensation deferral election trustee administrator distribution "
+    "provided that shall may under section amount benefit allocation period "
+    "hours employment beneficiary code regulation adopting amendment"
+).split()
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def _table(page: fitz.Page, rng: random.Random, top: float) -> None:
+    # A ruled election grid that pdfplumber's "lines" strategy finds
+    rows, widths = 6, [200, 160, 160]
+    shape = page.new_shape()
+    x0, height = 36, 18
+    for r in range(rows + 1):
+        shape.draw_line((x0, top + r * height), (x0 + sum(widths), top + r * height))
+    x = x0
+    for w in [0] + widths:
+        x += w
+        shape.draw_line((x, top), (x, top + rows * height))
+    shape.finish(width=0.5)
+    shape.commit()
+    for r in range(rows):
+        x = x0
+        for c, w in enumerate(widths):
+            text = f"Election {r + 1}" if c == 0 else rng.choice(["[X] Yes", "[ ] No", "N/A"])
+            page.insert_text((x + 3, top + r * height + 12), text, fontsize=8)
+            x += w
+
+
+def _scan(rng: random.Random, size=(480, 360)) -> bytes:
+    # A grey page "scan": smooth shading under noise, saved as a high-quality JPEG
+    w, h = size
+    noise = Image.frombytes("L", size, rng.randbytes(w * h))
+    shade = Image.linear_gradient("L").resize(size)
+    image = Image.blend(shade, noise, 0.35)
+    out = BytesIO()
+    image.save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+def plan_pdf(
+    pages: int, kind: Kind = "text", password: Optional[str] = None, seed: int = 0
+) -> bytes:
+    """A `pages`-page adoption agreement; `kind="images"` adds a scan per page."""
+    rng = random.Random(seed)
+    # Sections keep their order and a page each, however short the document
+    spread = max(0, pages - len(SECTIONS))
+    starts = {
+        1 + i + round(fraction * spread): (title, body)
+        for i, (fraction, title, body) in enumerate(SECTIONS)
+    }
+    doc = fitz.open()
+    logo = BytesIO()
+    Image.new("RGB", (240, 60), (20, 60, 120)).save(logo, "PNG")
+    section = "ADOPTION AGREEMENT"
+
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        paragraphs = 2 if kind == "images" else 5
+        if page_num in starts:
+            section, elections = starts[page_num]
+            text = f"{section}\n{elections}\n"
+            paragraphs -= 2
+        else:
+            text = f"{section} (continued)\n"
+        text += "\n\n".join(_paragraph(rng, 5) for _ in range(paragraphs))
+        # insert_textbox writes nothing at all when the text overflows
+        assert page.insert_textbox(fitz.Rect(36, 96, 576, 500), text, fontsize=8) >= 0
+        if page_num % 8 == 0:
+            _table(page, rng, 520)
+        if kind == "images":
+            page.insert_image(fitz.Rect(36, 24, 276, 84), stream=logo.getvalue())
+            page.insert_image(fitz.Rect(36, 520, 336, 745), stream=_scan(rng))
+        page.insert_text((36, 770), f"Page {page_num} of {pages}", fontsize=7)
+
+    doc.set_metadata({"title": "Synthetic 401(k) Adoption Agreement", "creationDate": ""})
+    # A fixed file ID keeps the output byte-for-byte reproducible
+    options = {"garbage": 3, "deflate": True, "no_new_id": True}
+    if password:
+        options |= {
+            "encryption": fitz.PDF_ENCRYPT_AES_256,
+            "user_pw": password,
+            "owner_pw": password + "-owner",
+        }
+    return doc.tobytes(**options)
+
+
+def fixture_path(
+    pages: int,
+    kind: Kind = "text",
+    password: Optional[str] = None,
+    seed: int = 0,
+    directory: Path = DEFAULT_DIR,
+) -> Path:
+    """Path of the fixture for these arguments, generated on first use."""
+    name = f"plan-v{VERSION}-{kind}-{pages}p{'-encrypted' if password else ''}-s{seed}.pdf"
+    path = Path(directory) / name
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(plan_pdf(pages, kind, password, seed))
+        tmp.replace(path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--kind", choices=["text", "images"], default="text")
+    parser.add_argument("--password")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", type=Path, default=DEFAULT_DIR)
+    args = parser.parse_args()
+    path = fixture_path(args.pages, args.kind, args.password, args.seed, args.dir)
+    print(f"{path} ({path.stat().st_size / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
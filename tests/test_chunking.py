@@ -0,0 +1,36 @@
+from utils.chunking import chunk_pages, count_tokens, select_chunks
+from utils.llm import format_chunk
+
+
+def _words(count: int, word: str = "plan") -> str:
+    return "\n".join(" ".join([word] * 10) for _ in range(count // 10))
+
+
+def test_small_pages_are_merged_with_their_page_numbers():
+    chunks = chunk_pages([(1, "cover"), (2, ""), (3, "trustee"), (4, "  \n"), (5, "ein")], 100)
+    assert chunks == [[(1, "cover"), (3, "trustee"), (5, "ein")]]
+    assert format_chunk(chunks[0]) == "[Page 1]\ncover\n\n[Page 3]\ntrustee\n\n[Page 5]\nein"
+
+
+def test_large_pages_are_split_and_keep_their_page_number():
+    pages = [(1, _words(40)), (2, _words(400, "vesting")), (3, _words(40))]
+    chunks = chunk_pages(pages, 120)
+
+    assert len(chunks) > 3
+    assert all(sum(count_tokens(text) for _, text in chunk) <= 120 for chunk in chunks)
+    # Every piece still names the page it came from, in page order
+    pieces = [piece for chunk in chunks for piece in chunk]
+    assert [page for page, _ in pieces] == sorted(page for page, _ in pieces)
+    for page_num, text in pages:
+        assert "".join(piece for page, piece in pieces if page == page_num) == text
+
+
+def test_terms_select_the_chunks_that_mention_them():
+    chunks = chunk_pages(
+        [(1, _words(40)), (2, _words(40, "trustee")), (3, _words(40)), (4, "vesting " * 40)], 60
+    )
+    selected = select_chunks(chunks, {"Trustee": ["trustee"], "Vesting": ["vesting"]}, 1)
+    assert {
+        term: [chunks[i][0][0] for i, terms in selected.items() if term in terms]
+        for term in ("Trustee", "Vesting")
+    } == {"Trustee": [2], "Vesting": [4]}
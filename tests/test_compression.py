@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+
+from utils.compression import compress
+
+
+def _pdf(label: str, pages: int = 30) -> bytes:
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{label} page {page_num}")
+        page.insert_text((72, 100), " ".join([label.lower()] * 80)[:90])
+    return doc.tobytes()
+
+
+def _texts(pdf: bytes) -> list:
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        return [page.get_text().splitlines()[0] for page in doc]
+
+
+def test_concurrent_compress_keeps_documents_apart():
+    # Both stay below PARALLEL_MIN_PAGES, so both deflate in-process
+    documents = {label: _pdf(label) for label in ("ALPHA", "BRAVO")}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for _ in range(5):
+            futures = {
+                label: executor.submit(compress, pdf) for label, pdf in documents.items()
+            }
+            for label, future in futures.items():
+                assert _texts(future.result()[0]) == [
+                    f"{label} page {page_num}" for page_num in range(1, 31)
+                ]
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+import fitz  # PyMuPDF
+import pytest
+
+from utils import helpers, jobs, pipeline
+from utils.document import PdfDocument
+from utils.jobs import JobQueue
+from utils.metrics import record, span
+
+
+def _pdf() -> bytes:
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Trustee: First National")
+    return doc.tobytes()
+
+
+def _wait(queue: JobQueue, job_id: str):
+    deadline = time.monotonic() + 30
+    while not (job := queue.get(job_id)).final:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return job
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(tmp_path)
+    monkeypatch.setattr(helpers, "get_queue", lambda: queue)
+    return queue
+
+
+def test_failed_extraction_is_only_run_again_on_retry(queue, monkeypatch):
+    calls = []
+
+    def extract_incremental(document, terms, stats, cancel):
+        calls.append(terms)
+        raise RuntimeError("OpenAI is down")
+
+    monkeypatch.setattr(pipeline, "extract_incremental", extract_incremental)
+    document = PdfDocument(_pdf())
+    first = helpers.submit_extraction(document, ["Trustee"])
+    assert _wait(queue, first).status == "failed"
+
+    # A rerun shows the failed job instead of starting another
+    assert helpers.submit_extraction(document, ["Trustee"]) == first
+    assert len(calls) == 1
+
+    retried = helpers.submit_extraction(document, ["Trustee"], resubmit=True)
+    assert retried != first
+    assert _wait(queue, retried).status == "failed"
+    assert helpers.submit_extraction(document, ["Trustee"]) == retried
+    assert len(calls) == 2
+
+
+def test_a_job_keeps_its_own_spans(tmp_path):
+    queue = JobQueue(tmp_path)
+
+    def task(source, progress, cancel) -> bytes:
+        with span("inner"):
+            record(pages=3)
+        return b"result"
+
+    job = _wait(queue, queue.submit("compress_pdf", "digest", {}, b"%PDF", task))
+    assert job.status == "done"
+    assert [(s["name"], s["parent"], s["pages"]) for s in job.spans] == [
+        ("inner", "compress_pdf", 3),
+        ("compress_pdf", None, 0),
+    ]
+
+
+def test_compression_report_is_kept_with_the_result(queue):
+    pdf = _pdf()
+    job = _wait(queue, helpers.submit_compress(pdf, ""))
+    assert job.status == "done"
+    assert queue.result(job.id)[:5] == b"%PDF-"
+    assert job.report["size_before"] == len(pdf)
+    assert job.report["table"]["columns"][:3] == ["Stage", "Before (KB)", "After (KB)"]
+    assert job.report["table"]["data"]
+
+
+def test_document_jobs_are_listed_for_the_same_password_only(queue):
+    pdf = _pdf()
+    job = _wait(queue, helpers.submit_compress(pdf, ""))
+    digest = PdfDocument(pdf).digest
+    assert [j.id for j in helpers.document_jobs(digest, "")] == [job.id]
+    assert helpers.document_jobs(digest, "guess") == []
+
+
+def test_startup_only_fails_jobs_of_processes_that_are_gone(tmp_path, monkeypatch):
+    first = JobQueue(tmp_path, workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def task(source, progress, cancel) -> bytes:
+        started.set()
+        release.wait(30)
+        return b"result"
+
+    running = first.submit("compress_pdf", "digest", {}, b"%PDF", task)
+    started.wait(30)
+    gone = first.submit("compress_pdf", "other", {}, b"%PDF", task)
+    (tmp_path / "inputs" / "999999999-dead").mkdir()
+    # As if `gone` had been queued by a process that has since exited
+    first._update(gone, owner="999999999-dead")
+
+    # Another process sharing the directory starts up
+    monkeypatch.setattr(jobs, "OWNER", f"{os.getpid() + 1}-other")
+    JobQueue(tmp_path)
+    assert first.get(running).status == "running"
+    assert first.get(gone).status == "failed"
+    assert first.inputs.exists()
+    assert not (tmp_path / "inputs" / "999999999-dead").exists()
+    release.set()
+    assert _wait(first, running).status == "done"
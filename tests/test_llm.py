@@ -0,0 +1,142 @@
+import re
+import threading
+import time
+
+import openai
+import pytest
+
+from utils import llm
+from utils.llm_cache import ResponseCache
+from utils.scheduler import RequestScheduler
+from utils.stub_server import StubCompletionServer
+
+
+@pytest.fixture
+def server():
+    server = StubCompletionServer().start()
+    api_base, api_key = openai.api_base, openai.api_key
+    openai.api_base, openai.api_key = server.api_base, "stub"
+    yield server
+    openai.api_base, openai.api_key = api_base, api_key
+    server.stop()
+
+
+def _extract(pages, terms, **kwargs):
+    stats = llm.UsageStats()
+    rows = llm.extract_relevant_information(
+        pages,
+        terms,
+        stats=stats,
+        cache=ResponseCache(":memory:"),
+        # One page per chunk, all of them asked
+        chunk_tokens=50,
+        top_k=None,
+        **kwargs,
+    )
+    return rows, stats
+
+
+def test_parse_response_table():
+    response = """Term | Response | Page number
+    |---|---|---|
+    | **Trustee** | First National Trust | Page 3 |
+    | EIN | 12-3456789 | |
+    | Year End | N/A | 4 |
+    | trustee | Someone Else | 9 |
+    Vesting | 100% Vested
+    """
+    assert llm.parse_response_table(response, ["Trustee", "EIN", "Year End", "Vesting"], 2) == {
+        "Trustee": ("First National Trust", 3),
+        "EIN": ("12-3456789", 2),
+        "Vesting": ("100% Vested", 2),
+    }
+
+
+def test_earliest_page_wins_when_a_later_chunk_finishes_first(monkeypatch):
+    def complete(prompt):
+        page = int(re.search(r"\[Page (\d+)\]", prompt).group(1))
+        # The first page is the slowest to answer
+        time.sleep(0.3 if page == 1 else 0.01)
+        return f"Trustee | Trustee {page} | {page}", {}
+
+    monkeypatch.setattr(llm, "complete", complete)
+    pages = [f"Trustee of page {page_num}" for page_num in range(1, 7)]
+    rows, stats = _extract(pages, ["Trustee"], scheduler=RequestScheduler(max_concurrency=3))
+    assert rows == [["Trustee", "Trustee 1", 1]]
+    assert stats.errors == []
+
+
+def test_failed_requests_are_reported(monkeypatch):
+    def complete(prompt):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(llm, "complete", complete)
+    rows, stats = _extract(["Trustee: A"], ["Trustee"], scheduler=RequestScheduler())
+    assert rows == [["Trustee", "", ""]]
+    assert stats.errors == ["ValueError: boom"]
+
+    with pytest.raises(RuntimeError):
+        llm.extract_relevant_information(
+            ["Trustee: A"],
+            ["Trustee"],
+            scheduler=RequestScheduler(),
+            cache=ResponseCache(":memory:"),
+        )
+
+
+def test_scheduler_retries_rate_limited_requests(server):
+    server.rate_limit_every = 3
+    scheduler = RequestScheduler(
+        max_concurrency=2, retry_on=(openai.error.RateLimitError,), backoff=0.01
+    )
+    results = list(
+        scheduler.run(
+            [f"[Page {i}]\nTrustee: T{i}" for i in range(1, 7)],
+            lambda text: llm.complete(llm.build_prompt(text, ["Trustee"])),
+        )
+    )
+    assert [error for _, _, error in results] == [None] * 6
+    assert sorted(result[0] for _, result, _ in results) == [
+        f"Term | Response | Page number\nTrustee | T{i} | {i}" for i in range(1, 7)
+    ]
+    # Every third request was refused and sent again
+    assert server.requests > 6
+
+
+def test_scheduler_stops_dispatching_once_done(server):
+    server.latency = 0.05
+    done = threading.Event()
+    scheduler = RequestScheduler(max_concurrency=2)
+    results = []
+    for job, result, error in scheduler.run(
+        range(20),
+        lambda i: llm.complete(llm.build_prompt(f"[Page {i}]\nTrustee: T{i}", ["Trustee"])),
+        is_done=done.is_set,
+    ):
+        results.append(job)
+        done.set()
+    # Only the requests in flight when the first came back were sent
+    assert len(results) <= 2
+    assert server.requests <= 2
+
+
+def test_extraction_against_stub_server(server):
+    pages = [
+        "Cover page",
+        "Plan name: Acme 401(k) Plan\nTrustee: First National",
+        "Trustee: Other",
+    ]
+    rows, stats = _extract(pages, ["Plan name", "Trustee"])
+    assert rows == [
+        ["Plan name", "Acme 401(k) Plan", 2],
+        ["Trustee", "First National", 2],
+    ]
+    assert stats.calls >= 1 and stats.total_tokens > 0
+
+
+def test_cancelled_extraction_sends_nothing(server):
+    cancel = threading.Event()
+    cancel.set()
+    rows, _ = _extract(["Trustee: A", "Trustee: B"], ["Trustee"], cancel=cancel)
+    assert rows == [["Trustee", "", ""]]
+    assert server.requests == 0
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import llm_cache
+from utils.llm_cache import ResponseCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_cache_key_ignores_whitespace_and_term_order():
+    assert cache_key("a  b\n c", ["EIN", "Trustee"], "t", "m") == cache_key(
+        "a b c", ["Trustee", "EIN"], "t", "m"
+    )
+    assert cache_key("a b c", ["EIN"], "t", "m") != cache_key("a b c", ["EIN"], "t", "other")
+
+
+def test_entries_expire_after_max_age(clock):
+    cache = ResponseCache(":memory:", max_age=60)
+    cache.put("old", "response", {"prompt_tokens": 3})
+    clock.now += 30
+    cache.put("new", "response", {})
+    assert cache.get("old") == ("response", {"prompt_tokens": 3})
+
+    clock.now += 40
+    assert cache.get("old") is None
+    assert cache.get("new") is not None
+    cache.evict()
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_by_size(clock):
+    # Each entry is 10 bytes of response and 2 of usage
+    cache = ResponseCache(":memory:", max_bytes=36, evict_every=1)
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        cache.put(key, "x" * 10, {})
+    clock.now += 1
+    cache.get("a")
+
+    clock.now += 1
+    cache.put("d", "x" * 10, {})
+    assert [key for key in "abcd" if cache.get(key)] == ["a", "c", "d"]
+    assert cache.stats()["bytes"] <= 36
+
+
+def test_entry_count_is_capped(clock):
+    cache = ResponseCache(":memory:", max_entries=2, evict_every=1)
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        cache.put(key, "response", {})
+    assert cache.stats()["entries"] == 2
+    assert cache.get("a") is None
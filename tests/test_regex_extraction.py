@@ -0,0 +1,74 @@
+import re
+
+import fitz  # PyMuPDF
+import pytest
+
+from benchmarks.fixtures import plan_pdf
+from utils.regex_extraction import PageTextIndex, extract_terms_from_text, terms_to_extract
+
+
+def _baseline(doc, patterns):
+    """The extractor as it was before the page index, kept as the reference."""
+    results = []
+    for term, config in patterns.items():
+        extracted_value = "Not Found"
+        page_number = "N/A"
+        pattern = config.get("pattern", None)
+        fallback = config.get("fallback", None)
+        page_hint = config.get("page_hint", None)
+
+        for page_num, page in enumerate(doc, start=1):
+            page_text = page.get_text("text")
+            if pattern:
+                match = re.search(pattern, page_text, re.IGNORECASE)
+                if match:
+                    extracted_value = match.group(1).strip()
+                    page_number = page_num
+                    break
+            if page_hint and page_hint.lower() in page_text.lower():
+                if fallback:
+                    extracted_value = fallback
+                    page_number = page_num
+        if extracted_value == "Not Found" and fallback:
+            extracted_value = fallback
+        results.append([term, extracted_value, page_number])
+    return results
+
+
+def _pdf(pages):
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 576, 756), text, fontsize=9)
+    return doc
+
+
+@pytest.mark.parametrize("pages,seed", [(12, 0), (60, 1), (200, 2)])
+def test_matches_baseline_on_adoption_agreements(pages, seed):
+    with fitz.open(stream=plan_pdf(pages, seed=seed), filetype="pdf") as doc:
+        expected = _baseline(doc, terms_to_extract)
+        assert extract_terms_from_text(doc, terms_to_extract) == expected
+        index = PageTextIndex.from_document(doc)
+        assert extract_terms_from_text(index, terms_to_extract) == expected
+
+
+def test_matches_baseline_on_fallbacks_and_misses():
+    patterns = {
+        "EIN": {"pattern": r"EIN:\s*(\d{2}-\d{7})", "page_hint": "EMPLOYER INFORMATION"},
+        # Unmatched, with and without a hint on some page
+        "Trustee": {"pattern": r"Trustee:\s*(.*?)\n", "fallback": "Not explicitly mentioned"},
+        "Elapsed Vesting": {
+            "pattern": r"Elapsed Vesting.*?\s(True|False)",
+            "fallback": "False",
+            "page_hint": "Vesting",
+        },
+        "Minimum Age": {"pattern": r"Age Requirement.*?\n.*?\n\s*(\d+)", "page_hint": "Nowhere"},
+    }
+    with _pdf(
+        [
+            "Cover\n",
+            "employer information\nein: 12-3456789\n",
+            "VESTING\nSchedules follow\n",
+            "More on vesting\n",
+        ]
+    ) as doc:
+        assert extract_terms_from_text(doc, patterns) == _baseline(doc, patterns)
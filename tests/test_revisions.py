@@ -0,0 +1,125 @@
+import re
+
+import fitz  # PyMuPDF
+import pytest
+
+from utils import llm, pipeline
+from utils.document import PdfDocument
+from utils.llm_cache import ResponseCache
+from utils.revisions import ExtractionStore, page_hashes
+
+PATTERNS = {"EIN": {"pattern": r"EIN:\s*(\d{2}-\d{7})"}}
+TERMS = ["EIN", "Trustee"]
+
+
+def _pdf(pages) -> bytes:
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+PAGES = [
+    "Adoption agreement",
+    "EIN: 12-3456789",
+    "Trustee: First National",
+    "Vesting schedule",
+    "Signatures",
+]
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    prompts = []
+
+    def complete(prompt):
+        prompts.append(prompt)
+        rows = [
+            f"Trustee | {match.group(2)} | {match.group(1)}"
+            for match in re.finditer(r"\[Page (\d+)\]\nTrustee: (.*)", prompt)
+        ]
+        return "\n".join(rows[:1]), {}
+
+    monkeypatch.setattr(llm, "complete", complete)
+    return prompts
+
+
+def _extract(pdf: bytes, store: ExtractionStore):
+    stats = pipeline.HybridStats()
+    document = PdfDocument(pdf)
+    try:
+        results = pipeline.extract_incremental(
+            document, TERMS, PATTERNS, stats=stats, store=store, cache=ResponseCache(":memory:")
+        )
+    finally:
+        document.close()
+    return {r.term: (r.value, r.page, r.source, r.recomputed) for r in results}, stats
+
+
+def test_page_hashes_follow_content_not_position():
+    with fitz.open(stream=_pdf(PAGES), filetype="pdf") as doc:
+        first = page_hashes(doc)
+    with fitz.open(stream=_pdf(["Cover"] + PAGES), filetype="pdf") as doc:
+        second = page_hashes(doc)
+    assert second[1:] == first
+    assert len(set(first)) == len(first)
+
+
+def test_one_changed_page_is_all_that_is_extracted_again(prompts):
+    store = ExtractionStore(":memory:")
+    original = _pdf(PAGES)
+    first, _ = _extract(original, store)
+    assert first == {
+        "EIN": ("12-3456789", 2, "regex", True),
+        "Trustee": ("First National", 3, "llm", True),
+    }
+
+    # A revision that only edits the vesting page
+    prompts.clear()
+    revised = PAGES[:3] + ["Vesting schedule, amended"] + PAGES[4:]
+    second, stats = _extract(_pdf(revised), store)
+    assert stats.revision_of == PdfDocument(original).digest
+    assert stats.pages_changed == 1
+    assert second == {
+        "EIN": ("12-3456789", 2, "regex", False),
+        "Trustee": ("First National", 3, "llm", False),
+    }
+    # Only the changed page went to the LLM
+    assert stats.pages_sent == 1
+    assert [re.findall(r"\[Page (\d+)\]", prompt) for prompt in prompts] == [["4"]]
+
+
+def test_an_edited_answer_page_is_searched_again(prompts):
+    store = ExtractionStore(":memory:")
+    _extract(_pdf(PAGES), store)
+
+    revised = PAGES[:2] + ["Trustee: Second Federal"] + PAGES[3:]
+    second, stats = _extract(_pdf(revised), store)
+    assert stats.pages_changed == 1
+    assert second["Trustee"] == ("Second Federal", 3, "llm", True)
+
+
+def test_failed_runs_are_not_stored(monkeypatch):
+    def complete(prompt):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(llm, "complete", complete)
+    store = ExtractionStore(":memory:")
+    original = _pdf(PAGES)
+    results, stats = _extract(original, store)
+    assert results["Trustee"] == ("", "", "none", True)
+    assert stats.usage.errors
+    assert store.get(PdfDocument(original).digest) is None
+
+
+def test_store_finds_the_closest_revision_and_scopes_its_text():
+    store = ExtractionStore(":memory:")
+    store.save("old", ["a", "b", "c", "d"], [], "model", {"a": "text a", "b": "text b"})
+    store.save("other", ["x", "y"], [], "model", {"x": "text x"})
+
+    assert store.find_previous(["a", "b", "c", "z"]).digest == "old"
+    # Fewer than half of the pages shared
+    assert store.find_previous(["a", "w", "x", "z"]) is None
+    assert store.texts("old", ["a", "c", "x"]) == {"a": "text a"}
+    # Text is never lent to another document that shares a page
+    assert store.texts("other", ["a", "b"]) == {}
@@ -0,0 +1,88 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import url_loader
+from utils.document import BytesCache
+from utils.url_loader import DownloadTooLarge, fetch_pdf
+
+BODY = b"%PDF-1.7\n" + bytes(range(256)) * 64
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.server.log.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/plan.pdf":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+        elif self.path == "/declared.pdf":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+        else:
+            # No Content-Length, so the size is only known while reading
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(BODY)
+
+
+@pytest.fixture
+def base_url(monkeypatch):
+    monkeypatch.setattr(url_loader, "bodies", BytesCache(url_loader.CACHE_BYTES))
+    monkeypatch.setattr(url_loader, "_downloads", {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.log = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", server.log
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_is_reused_while_fresh(base_url):
+    base, log = base_url
+    first = fetch_pdf(f"{base}/plan.pdf")
+    assert first.data == BODY and first.etag == ETAG
+    assert fetch_pdf(f"{base}/plan.pdf") == first
+    assert len(log) == 1
+
+
+def test_stale_download_is_revalidated(base_url):
+    base, log = base_url
+    first = fetch_pdf(f"{base}/plan.pdf", fresh_seconds=0)
+    second = fetch_pdf(f"{base}/plan.pdf", fresh_seconds=0)
+    assert log == [("/plan.pdf", None), ("/plan.pdf", ETAG)]
+    assert (second.data, second.digest) == (first.data, first.digest)
+    assert second.checked_at >= first.checked_at
+
+
+def test_evicted_body_is_downloaded_again(base_url, monkeypatch):
+    base, log = base_url
+    # Room for a single body: fetching a second evicts the first
+    monkeypatch.setattr(url_loader, "bodies", BytesCache(len(BODY)))
+    fetch_pdf(f"{base}/plan.pdf")
+    fetch_pdf(f"{base}/declared.pdf")
+    assert fetch_pdf(f"{base}/plan.pdf", fresh_seconds=0).data == BODY
+    assert log[-1] == ("/plan.pdf", None)
+    assert set(url_loader._downloads) == {f"{base}/plan.pdf"}
+
+
+@pytest.mark.parametrize("path", ["/declared.pdf", "/streamed.pdf"])
+def test_oversize_download_is_aborted(base_url, path):
+    base, _ = base_url
+    with pytest.raises(DownloadTooLarge):
+        fetch_pdf(f"{base}{path}", max_bytes=len(BODY) - 1)
+    assert fetch_pdf(f"{base}{path}", max_bytes=len(BODY)).data == BODY
@@ -0,0 +1,107 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _encoding = None
+
+# A chunk is a run of (page_number, text) pieces; a split page repeats its number
+Chunk = List[Tuple[int, str]]
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def clean_text(text: str) -> str:
+    text = text.lower()
+    text = re.sub(r"[^\w\s]", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text
+
+
+def _split_page(page_num: int, text: str, max_tokens: int) -> List[Tuple[int, str]]:
+    pieces, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = count_tokens(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            pieces.append((page_num, "".join(current)))
+            current, current_tokens = [], 0
+        # A single overlong line is cut by characters
+        while line_tokens > max_tokens:
+            cut = max_tokens * 4
+            pieces.append((page_num, line[:cut]))
+            line = line[cut:]
+            line_tokens = count_tokens(line)
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append((page_num, "".join(current)))
+    return pieces
+
+
+def chunk_pages(pages: Iterable[Tuple[int, str]], max_tokens: int = 1500) -> List[Chunk]:
+    """Merge consecutive small pages and split large ones to about `max_tokens` each."""
+    chunks: List[Chunk] = []
+    current: Chunk = []
+    current_tokens = 0
+    for page_num, text in pages:
+        if not text or not text.strip():
+            continue
+        for piece in _split_page(page_num, text, max_tokens):
+            tokens = count_tokens(piece[1])
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def bm25_scores(
+    documents: Sequence[List[str]], query: Sequence[str], k1: float = 1.5, b: float = 0.75
+) -> List[float]:
+    n = len(documents)
+    if n == 0:
+        return []
+    avg_len = sum(map(len, documents)) / n or 1
+    frequencies = [Counter(doc) for doc in documents]
+    scores = [0.0] * n
+    for word in set(query):
+        df = sum(1 for freq in frequencies if word in freq)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for i, freq in enumerate(frequencies):
+            if tf := freq.get(word):
+                norm = k1 * (1 - b + b * len(documents[i]) / avg_len)
+                scores[i] += idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def select_chunks(
+    chunks: Sequence[Chunk], keywords: Dict[str, Sequence[str]], top_k: int = 3
+) -> Dict[int, List[str]]:
+    """Rank chunks per term and map each selected chunk index to its terms.
+
+    Terms without a single keyword hit fall back to the first `top_k` chunks.
+    """
+    documents = [clean_text(" ".join(text for _, text in chunk)).split() for chunk in chunks]
+    selected: Dict[int, List[str]] = {}
+    for term, words in keywords.items():
+        scores = bm25_scores(documents, [t for w in words for t in clean_text(w).split()])
+        ranked = sorted(
+            (i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i]
+        )[:top_k] or list(range(min(top_k, len(chunks))))
+        for i in ranked:
+            selected.setdefault(i, []).append(term)
+    return dict(sorted(selected.items()))
@@ -0,0 +1,201 @@
+import hashlib
+import time
+import zlib
+from functools import partial
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, EncodedStreamObject, IndirectObject, NameObject
+
+from utils.workers import PdfSource, open_source, process_pool, source_size
+
+# Below this many pages, deflating in-process beats starting a pool
+PARALLEL_MIN_PAGES = 50
+
+Progress = Callable[[float, str], None]
+
+# Reader of a pool worker process, opened once by the pool initializer. The
+# in-process path passes its own reader instead, as threads share this global.
+_reader: Optional[PdfReader] = None
+
+
+def _open(pdf: PdfSource, password: str) -> None:
+    global _reader
+    _reader = PdfReader(open_source(pdf))
+    if _reader.is_encrypted:
+        _reader.decrypt(password)
+
+
+def _deflate_with(
+    reader: PdfReader, job: Tuple[int, int]
+) -> Tuple[int, Optional[bytes], int, str]:
+    """Join one page's content streams and deflate them at `level`.
+
+    Returns the page index, the compressed bytes, the stored size of the
+    original streams and a digest of the decoded content.
+    """
+    page_index, level = job
+    contents = reader.pages[page_index].get("/Contents")
+    if contents is None:
+        return page_index, None, 0, ""
+    contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        streams = [stream.get_object() for stream in contents]
+    else:
+        streams = [contents]
+
+    data = b"\n".join(stream.get_data() for stream in streams)
+    before = sum(len(stream._data) for stream in streams)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return page_index, zlib.compress(data, level), before, digest
+
+
+def _deflate(job: Tuple[int, int]) -> Tuple[int, Optional[bytes], int, str]:
+    return _deflate_with(_reader, job)
+
+
+def _write(writer: PdfWriter) -> bytes:
+    bytes_stream = BytesIO()
+    writer.write(bytes_stream)
+    return bytes_stream.getvalue()
+
+
+def compress(
+    pdf: PdfSource,
+    password: str = "",
+    level: int = -1,
+    object_streams: bool = False,
+    workers: Optional[int] = None,
+    progress: Optional[Progress] = None,
+) -> Tuple[bytes, pd.DataFrame, float]:
+    """Shrink `pdf` in up to three stages, reporting size and time for each.
+
+    1. Page content streams are joined and deflated, in worker processes for
+       long documents. Pages with identical content share one stream.
+    2. Identical objects (fonts, images, forms) are merged and orphans dropped.
+    3. Optionally, objects are packed into compressed object streams.
+
+    `progress(fraction, text)` is called as work completes; a Streamlit
+    progress bar's `progress` method fits. Returns the new PDF, a per-stage
+    report, and the elapsed seconds.
+    """
+    progress = progress or (lambda fraction, text: None)
+    start = time.perf_counter()
+    stages: List[dict] = []
+
+    # Pages are read from the source until the output is written
+    with open_source(pdf) as source:
+        reader = PdfReader(source)
+        if reader.is_encrypted:
+            reader.decrypt(password)
+        writer = PdfWriter(clone_from=reader)
+
+        # Stage 1: content streams
+        stage_start = time.perf_counter()
+        jobs = [(i, level) for i in range(len(writer.pages))]
+        if len(jobs) >= PARALLEL_MIN_PAGES and workers != 1:
+            pool = process_pool(workers, _open, (pdf, password))
+            results = pool.map(_deflate, jobs, chunksize=16)
+        else:
+            pool = None
+            # Cloning leaves the reader untouched, so it serves the pages as well
+            results = map(partial(_deflate_with, reader), jobs)
+
+        shared: Dict[str, object] = {}
+        replaced: List[object] = []
+        before = after = duplicates = 0
+        try:
+            for done, (page_index, data, stored, digest) in enumerate(results, start=1):
+                if done % 10 == 0 or done == len(jobs):
+                    progress(0.7 * done / len(jobs), f"Compressing page {done} of {len(jobs)}")
+                if data is None:
+                    continue
+                before += stored
+                page = writer.pages[page_index]
+                original = page.raw_get("/Contents")
+                if isinstance(original.get_object(), ArrayObject):
+                    replaced.extend(original.get_object())
+                replaced.append(original)
+                if digest in shared:
+                    duplicates += 1
+                    page[NameObject("/Contents")] = shared[digest]
+                    continue
+                single = not isinstance(page["/Contents"].get_object(), ArrayObject)
+                if single and len(data) >= stored:
+                    # Already compressed at least as well; keep it, but share it
+                    shared[digest] = page.raw_get("/Contents")
+                    after += stored
+                    continue
+                stream = EncodedStreamObject()
+                stream._data = data
+                stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+                page[NameObject("/Contents")] = shared[digest] = writer._add_object(stream)
+                after += len(data)
+        finally:
+            # Pages not yet deflated are dropped if progress raised to cancel
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        # Drop the streams that were swapped out. Left as orphans, they would
+        # hash equal to their replacements when identical objects are merged.
+        in_use = {getattr(page.raw_get("/Contents"), "idnum", None) for page in writer.pages}
+        for ref in replaced:
+            if isinstance(ref, IndirectObject) and ref.idnum not in in_use:
+                writer._objects[ref.idnum - 1] = None
+
+        stages.append(
+            {
+                "Stage": "Content streams",
+                "Before (KB)": before / 1024,
+                "After (KB)": after / 1024,
+                "Seconds": time.perf_counter() - stage_start,
+                "Detail": f"{len(jobs)} pages, {duplicates} duplicate streams shared",
+            }
+        )
+
+        # Stage 2: identical objects
+        stage_start = time.perf_counter()
+        progress(0.75, "Merging identical objects")
+        objects = sum(obj is not None for obj in writer._objects)
+        writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+        removed = objects - sum(obj is not None for obj in writer._objects)
+        progress(0.85, "Writing")
+        output = _write(writer)
+        stages.append(
+            {
+                "Stage": "Identical objects",
+                "Before (KB)": source_size(pdf) / 1024,
+                "After (KB)": len(output) / 1024,
+                "Seconds": time.perf_counter() - stage_start,
+                "Detail": f"{removed} duplicate or unused objects removed",
+            }
+        )
+
+    # Stage 3: object streams
+    if object_streams:
+        import fitz  # PyMuPDF
+
+        stage_start = time.perf_counter()
+        progress(0.9, "Packing object streams")
+        with fitz.open(stream=output, filetype="pdf") as doc:
+            packed = doc.tobytes(garbage=4, deflate=True, use_objstms=1)
+        gained = len(packed) < len(output)
+        stages.append(
+            {
+                "Stage": "Object streams",
+                "Before (KB)": len(output) / 1024,
+                "After (KB)": len(packed if gained else output) / 1024,
+                "Seconds": time.perf_counter() - stage_start,
+                "Detail": "objects packed into object streams" if gained else "no gain, skipped",
+            }
+        )
+        if gained:
+            output = packed
+
+    progress(1.0, "Done")
+    report = pd.DataFrame(
+        stages, columns=["Stage", "Before (KB)", "After (KB)", "Seconds", "Detail"]
+    )
+    return output, report, time.perf_counter() - start
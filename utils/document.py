@@ -0,0 +1,269 @@
+import functools
+import hashlib
+import mmap
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, TypeVar, Union
+
+import fitz  # PyMuPDF
+import pdfplumber
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+import streamlit as st
+from streamlit import session_state
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from utils.metrics import record, span
+from utils.regex_extraction import PageTextIndex
+from utils.workers import PdfSource, open_fitz
+
+# Parsed documents kept per session; older ones are closed when evicted
+MAX_DOCUMENTS = 2
+# Uploads at least this large are spooled to disk and memory-mapped
+SPOOL_MIN_BYTES = 32 * 1024**2
+SPOOL_BLOCK_BYTES = 1024**2
+
+T = TypeVar("T")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fingerprint(pdf: Union[bytes, mmap.mmap]) -> str:
+    """Content hash of `pdf`, reused from the session's loaded documents.
+
+    A document's digest is computed once when it is loaded; passing the same
+    bytes or mapping back in is a lookup rather than another full hash.
+    """
+    for document in session_state.get("documents", {}).values():
+        if document.data is pdf:
+            return document.digest
+    return content_hash(pdf)
+
+
+def cache_by_fingerprint(func: Callable[..., T]) -> Callable[..., T]:
+    """`st.cache_data` for functions whose first argument is a PDF.
+
+    The PDF is keyed by its fingerprint, so a cache lookup costs the same
+    however large the document is. The other arguments are hashed as usual.
+    """
+
+    def cached(_pdf, digest: str, *args, **kwargs):
+        return func(_pdf, *args, **kwargs)
+
+    # Streamlit keys each cache by module, qualified name and source
+    cached.__module__, cached.__qualname__ = func.__module__, func.__qualname__
+    cached = st.cache_data(show_spinner=f"Running {func.__name__}(...).")(cached)
+
+    @functools.wraps(func)
+    def wrapper(pdf, *args, **kwargs):
+        return cached(pdf, fingerprint(pdf), *args, **kwargs)
+
+    wrapper.clear = cached.clear
+    return wrapper
+
+
+class BytesCache:
+    """LRU cache of byte strings keyed by tuples, capped by total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def put(self, key: Hashable, data: bytes) -> None:
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class LruCache:
+    """LRU cache of arbitrary values keyed by tuples, capped by entry count."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+def spill_dir() -> Path:
+    """Temporary directory private to this session.
+
+    It is removed when the session ends and its state is released, or at
+    interpreter exit, whichever comes first.
+    """
+    if "spill_dir" not in session_state:
+        session_state["spill_dir"] = tempfile.TemporaryDirectory(prefix="pdf-session-")
+    return Path(session_state["spill_dir"].name)
+
+
+class PdfDocument:
+    """One uploaded PDF: the bytes, plus parsers built on first use and reused.
+
+    A document spooled to disk has a `path`, and `data` is a read-only memory
+    map of that file rather than bytes in memory.
+    """
+
+    def __init__(
+        self,
+        data: Union[bytes, mmap.mmap],
+        password: Optional[str] = None,
+        digest: str = None,
+        path: Optional[Path] = None,
+    ):
+        self.data = data
+        self.password = password or ""
+        self.digest = digest or content_hash(data)
+        self.path = path
+
+    @classmethod
+    def from_path(
+        cls, path: Path, password: Optional[str] = None, digest: str = None
+    ) -> "PdfDocument":
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, password, digest, path)
+
+    @property
+    def source(self) -> PdfSource:
+        """What worker processes should open: the spooled file, else the bytes."""
+        return str(self.path) if self.path else self.data
+
+    @cached_property
+    def fitz(self) -> fitz.Document:
+        doc = open_fitz(self.source)
+        if doc.needs_pass:
+            doc.authenticate(self.password)
+        return doc
+
+    @cached_property
+    def reader(self) -> PdfReader:
+        stream = self.data if self.path else BytesIO(self.data)
+        try:
+            return PdfReader(stream, password=self.password or None)
+        except PdfReadError:
+            return PdfReader(stream)
+
+    @cached_property
+    def plumber(self) -> pdfplumber.PDF:
+        # Given a path, pdfplumber owns the file and closes it with the document
+        source = self.source if self.path else BytesIO(self.data)
+        return pdfplumber.open(source, password=self.password)
+
+    @cached_property
+    def page_index(self) -> PageTextIndex:
+        with span("index_pages"):
+            record(pages=self.page_count)
+            return PageTextIndex.from_document(self.fitz)
+
+    @property
+    def page_count(self) -> int:
+        return self.fitz.page_count
+
+    def close(self) -> None:
+        if "fitz" in self.__dict__:
+            self.fitz.close()
+        if "plumber" in self.__dict__:
+            self.plumber.close()
+        if self.path:
+            self.data.close()
+
+
+def _spool(file: UploadedFile) -> Tuple[Path, str]:
+    """Copy a large upload to the session's spill directory, hashing it on the way."""
+    uploads: Dict[str, Tuple[Path, str]] = session_state.setdefault("uploads", {})
+    if file.file_id in uploads:
+        return uploads[file.file_id]
+
+    # Drop spooled uploads no open document uses any more
+    live = {digest for digest, _ in session_state.get("documents", {})}
+    for file_id, (path, digest) in list(uploads.items()):
+        if digest not in live:
+            path.unlink(missing_ok=True)
+            del uploads[file_id]
+
+    path = spill_dir() / f"{file.file_id}.pdf"
+    digest = hashlib.blake2b(digest_size=16)
+    file.seek(0)
+    with open(path, "wb") as out:
+        while block := file.read(SPOOL_BLOCK_BYTES):
+            digest.update(block)
+            out.write(block)
+    file.seek(0)
+    uploads[file.file_id] = path, digest.hexdigest()
+    return uploads[file.file_id]
+
+
+def get_document(
+    data: Union[bytes, mmap.mmap, UploadedFile],
+    password: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> PdfDocument:
+    """Session-cached `PdfDocument` for `data`, parsed at most once per content hash.
+
+    Uploads of `SPOOL_MIN_BYTES` or more are spooled to disk once and
+    memory-mapped instead of being copied around as bytes. A `digest`
+    already computed while downloading spares hashing the data again.
+    """
+    documents: OrderedDict = session_state.setdefault("documents", OrderedDict())
+    path = None
+    if isinstance(data, UploadedFile):
+        if data.size >= SPOOL_MIN_BYTES:
+            path, digest = _spool(data)
+        else:
+            data = data.getvalue()
+    if path is None:
+        digest = digest or fingerprint(data)
+        # The mapping of a spooled upload, passed back in by a helper
+        uploads = session_state.get("uploads", {}).values()
+        path = next((p for p, d in uploads if d == digest), None)
+    key = (digest, password or "")
+
+    if key in documents:
+        documents.move_to_end(key)
+        return documents[key]
+
+    if path is not None:
+        document = PdfDocument.from_path(path, password, digest)
+    else:
+        document = PdfDocument(data, password, digest)
+    documents[key] = document
+    while len(documents) > MAX_DOCUMENTS:
+        documents.popitem(last=False)[1].close()
+    return document
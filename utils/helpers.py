@@ -1,23 +1,43 @@
 import contextlib
 import re
+import tempfile
 from datetime import datetime
 from io import BytesIO
+from itertools import islice
 from pathlib import Path
 from random import random
-from typing import Callable, Dict, Literal, Optional, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Literal, Optional, Sequence, Tuple, Union
 
 import pandas as pd
-import pdfplumber
 import requests
 import streamlit as st
-from pdf2docx import Converter
 from PIL import Image
 from pypdf import PdfReader, PdfWriter, Transformation
-from pypdf.errors import PdfReadError, PdfStreamError
+from pypdf.errors import PdfStreamError
 from streamlit import session_state
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from streamlit_pdf_viewer import pdf_viewer
 
+from utils import llm, pipeline
+from utils.compression import compress
+from utils.document import (
+    BytesCache,
+    PdfDocument,
+    cache_by_fingerprint,
+    content_hash,
+    fingerprint,
+    get_document,
+    spill_dir,
+)
+from utils.images import ImageRecord, recompress_images, save_images
+from utils.jobs import Job, get_queue
+from utils.metrics import COLUMNS, instrument, record, span
+from utils.parallel_text import extract_pages_parallel
+from utils.tables import export_tables, iter_tables
+from utils.url_loader import DownloadTooLarge, fetch_pdf
+from utils.word import convert_to_docx
+from utils.workers import open_source
+
 
 def select_pages(container, key: str):
     return container.text_input(
@@ -35,37 +55,52 @@ def select_pages(container, key: str):
     ).lower()
 
 
-@st.cache_data
-def image_to_pdf(stamp_img: Union[Path, str]) -> PdfReader:
-    img = Image.open(stamp_img)
+# Decrypted and watermarked PDFs keyed by (operation, content hash, secret hash)
+results = BytesCache(max_bytes=256 * 1024**2)
+
+
+def image_to_pdf(stamp_img: bytes) -> PdfReader:
+    img = Image.open(BytesIO(stamp_img))
     img_as_pdf = BytesIO()
     img.save(img_as_pdf, "pdf")
     return PdfReader(img_as_pdf)
 
 
-@st.cache_data
+@instrument()
 def watermark_img(
-    reader: PdfReader,
-    stamp_img: UploadedFile,
-) -> None:
+    pdf: bytes,
+    stamp_img: Union[UploadedFile, bytes],
+    password: Optional[str] = None,
+) -> bytes:
+    stamp = stamp_img if isinstance(stamp_img, bytes) else stamp_img.getvalue()
+    secret = content_hash((password or "").encode())
+    key = ("watermark", fingerprint(pdf), content_hash(stamp), secret)
+    if (watermarked := results.get(key)) is not None:
+        return watermarked
+
+    document = get_document(pdf, password)
+    record(pages=document.page_count)
+
     # Convert the image to a PDF
-    stamp_pdf = image_to_pdf(stamp_img)
+    stamp_pdf = image_to_pdf(stamp)
 
     # Then use the same stamp code from above
     stamp_page = stamp_pdf.pages[0]
 
     writer = PdfWriter()
 
-    writer.append(reader)
+    writer.append(document.reader)
 
     for content_page in writer.pages:
         content_page.merge_transformed_page(
             stamp_page, Transformation(), expand=True, over=False
         )
 
-    # TODO: Write to byte_stream
-    with open("watermarked.pdf", "wb") as fp:
-        writer.write(fp)
+    bytes_stream = BytesIO()
+    writer.write(bytes_stream)
+    watermarked = bytes_stream.getvalue()
+    results.put(key, watermarked)
+    return watermarked
 
 
 def get_option(key: Literal["main", "merge"]) -> str:
@@ -104,12 +139,9 @@ def upload_pdf(
     ):
         session_state["file"] = file
         session_state["name"] = file.name
-        pdf = file.getvalue()
-        try:
-            reader = PdfReader(BytesIO(pdf), password=password)
-        except PdfReadError:
-            reader = PdfReader(BytesIO(pdf))
-        return pdf, reader
+        # Large uploads come back memory-mapped rather than as bytes
+        document = get_document(file, password)
+        return document.data, document.reader
     return None, None
 
 
@@ -122,22 +154,19 @@ def load_pdf_from_url(
         value="https://getsamplefiles.com/download/pdf/sample-1.pdf",
     )
 
-    @st.cache_data
-    def _cached_get_url(url: str) -> requests.Response:
-        return requests.get(url)
-
     if url != "":
         try:
-            response = _cached_get_url(url)
-            session_state["file"] = pdf = response.content
+            with span("fetch_pdf"):
+                download = fetch_pdf(url)
+            session_state["file"] = pdf = download.data
             session_state["name"] = url.split("/")[-1]
-            try:
-                reader = PdfReader(BytesIO(pdf), password=password)
-            except PdfReadError:
-                reader = PdfReader(BytesIO(pdf))
-            return pdf, reader
+            return pdf, get_document(pdf, password, download.digest).reader
         except PdfStreamError:
             st.error("The URL does not seem to be a valid PDF file.", icon="❌")
+        except DownloadTooLarge as e:
+            st.error(f"The PDF is too large to load: {e}", icon="❌")
+        except requests.RequestException as e:
+            st.error(f"Could not load the URL: {e}", icon="❌")
     return None, None
 
 
@@ -168,16 +197,10 @@ def load_pdf(
     return None, None, "", False
 
 
-def handle_encrypted_pdf(reader: PdfReader, password: str, key: str) -> None:
+def handle_encrypted_pdf(pdf: bytes, password: str, key: str) -> None:
     if password:
-        session_state["decrypted_filename"] = f"unprotected_{session_state['name']}"
-        decrypt_pdf(
-            reader,
-            password,
-            filename=session_state["decrypted_filename"],
-        )
         pdf_viewer(
-            f"unprotected_{session_state['name']}",
+            decrypt_pdf(pdf, password),
             height=600 if key == "main" else 250,
             key=str(random()),
         )
@@ -187,7 +210,7 @@ def handle_encrypted_pdf(reader: PdfReader, password: str, key: str) -> None:
 
 def handle_unencrypted_pdf(pdf: bytes, key: str) -> None:
     pdf_viewer(
-        pdf,
+        get_document(pdf).source,
         height=600 if key == "main" else 250,
         key=str(random()),
     )
@@ -219,14 +242,14 @@ def preview_pdf(
             lcol, rcol = st.columns([2, 1])
             with lcol.expander("📄 **Preview**", expanded=bool(pdf)):
                 if reader.is_encrypted:
-                    handle_encrypted_pdf(reader, password, key)
+                    handle_encrypted_pdf(pdf, password, key)
                 else:
                     handle_unencrypted_pdf(pdf, key)
 
             with rcol.expander("🗄️ **Metadata**"):
                 display_metadata(reader)
         elif reader.is_encrypted:
-            handle_encrypted_pdf(reader, password, key)
+            handle_encrypted_pdf(pdf, password, key)
         else:
             handle_unencrypted_pdf(pdf, key)
 
@@ -278,38 +301,78 @@ def parse_page_numbers(page_numbers_str):
 
 
 
+def iter_text(
+    reader: PdfReader,
+    page_numbers_str: str = "all",
+    mode: Literal["plain", "layout"] = "plain",
+    max_pages: Optional[int] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Lazily yield `(page_number, text)`, 1-based, stopping after `max_pages`."""
+    if page_numbers_str == "all":
+        pages = range(len(reader.pages))
+    else:
+        pages = parse_page_numbers(page_numbers_str)
+
+    for page in islice(pages, max_pages):
+        text = reader.pages[page].extract_text(extraction_mode=mode)
+        record(pages=1)
+        yield page + 1, text
+
+
+@instrument()
 def extract_text(
-    reader: PdfReader.pages,
+    reader: PdfReader,
     page_numbers_str: str = "all",
     mode: Literal["plain", "layout"] = "plain",
+    max_pages: Optional[int] = None,
 ) -> str:
-    text = ""
+    return "".join(
+        " " + text for _, text in iter_text(reader, page_numbers_str, mode, max_pages)
+    )
+
 
+@instrument()
+def extract_text_parallel(
+    pdf: bytes,
+    page_numbers_str: str = "all",
+    mode: Literal["plain", "layout"] = "plain",
+    workers: Optional[int] = None,
+    password: Optional[str] = None,
+) -> str:
+    document = get_document(pdf, password)
     if page_numbers_str == "all":
-        for page in reader.pages:
-            text = text + " " + page.extract_text(extraction_mode=mode)
+        pages = range(len(document.reader.pages))
     else:
         pages = parse_page_numbers(page_numbers_str)
-        for page in pages:
-            text = text + " " + reader.pages[page].extract_text()
+    record(pages=len(pages))
 
-    return text
+    return "".join(
+        " " + text
+        for _, text in extract_pages_parallel(
+            document.source, list(pages), mode, workers, password=password
+        )
+    )
 
 
-def extract_images(reader: PdfReader.pages, page_numbers_str: str = "all") -> str:
-    images = {}
+@instrument()
+def extract_images(
+    reader: PdfReader,
+    page_numbers_str: str = "all",
+    target: Optional[Union[Path, str]] = None,
+) -> List[ImageRecord]:
+    """Save the distinct images to `target` (a directory or .zip) and list them.
+
+    Without a target, images go to a new directory in the session's spill
+    directory, removed with the session.
+    """
+    target = target or tempfile.mkdtemp(prefix="images-", dir=spill_dir())
     if page_numbers_str == "all":
-        for page in reader.pages:
-            images |= {image.data: image.name for image in page.images}
-
+        pages = range(len(reader.pages))
     else:
         pages = parse_page_numbers(page_numbers_str)
-        for page in pages:
-            images.update(
-                {image.data: image.name for image in reader.pages[page].images}
-            )
+    record(pages=len(pages))
 
-    return images
+    return save_images(reader, pages, target)
 
 
 def extract_tables(file, page_numbers_str):
@@ -330,62 +393,68 @@ def extract_tables(file, page_numbers_str):
 
     header = st.checkbox("Header")
 
-    first_row_index = 1 if header else 0
-
-    with pdfplumber.open(
-        BytesIO(file) if isinstance(file, bytes) else file,
-        password=session_state["password"],
-    ) as table_pdf:
-        if page_numbers_str == "all":
-            for page in table_pdf.pages:
-                for table in page.extract_tables(
-                    {
-                        "vertical_strategy": vertical_strategy,
-                        "horizontal_strategy": horizontal_strategy,
-                    }
-                ):
-                    st.write(
-                        pd.DataFrame(
-                            table[first_row_index:],
-                            columns=table[0] if header else None,
-                        )
-                    )
-        else:
-            pages = parse_page_numbers(page_numbers_str)
-            for page in pages:
-                for page in table_pdf.pages[page : page + 1]:
-                    for table in page.extract_tables(
-                        {
-                            "vertical_strategy": vertical_strategy,
-                            "horizontal_strategy": horizontal_strategy,
-                        }
-                    ):
-                        st.write(
-                            pd.DataFrame(
-                                table[first_row_index:],
-                                columns=table[0] if header else None,
-                            )
-                        )
-
-
-def decrypt_pdf(reader: PdfReader, password: str, filename: str) -> None:
-    reader.decrypt(password)
+    document = get_document(file, session_state["password"])
+    page_count = len(document.plumber.pages)
+    if page_numbers_str == "all":
+        pages = range(page_count)
+    else:
+        pages = [p for p in parse_page_numbers(page_numbers_str) if 0 <= p < page_count]
+
+    # Tables are written as soon as each page is done
+    found = []
+    with span("extract_tables"):
+        record(pages=len(pages))
+        for page, index, table in iter_tables(
+            document, pages, vertical_strategy, horizontal_strategy, header
+        ):
+            st.write(table)
+            found.append((page, index, table))
+
+    if found:
+        col0, col1 = st.columns(2)
+        col0.download_button(
+            "Download all tables (Excel)",
+            data=lambda: export_tables(found, "xlsx"),
+            file_name="tables.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+        col1.download_button(
+            "Download all tables (Parquet)",
+            data=lambda: export_tables(found, "parquet"),
+            file_name="tables.parquet",
+            mime="application/vnd.apache.parquet",
+        )
 
-    writer = PdfWriter()
 
-    for page in reader.pages:
-        writer.add_page(page)
+@instrument()
+def decrypt_pdf(pdf: bytes, password: str) -> bytes:
+    key = ("decrypt", fingerprint(pdf), content_hash(password.encode()))
+    if (decrypted := results.get(key)) is not None:
+        return decrypted
 
-    with open(filename, "wb") as f:
-        writer.write(f)
+    document = get_document(pdf, password)
+    record(pages=document.page_count)
+    with open_source(document.source) as stream:
+        reader = PdfReader(stream)
+        reader.decrypt(password)
 
+        writer = PdfWriter()
 
-@st.cache_data
-def remove_images(pdf: bytes, remove_images: bool, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
+        for page in reader.pages:
+            writer.add_page(page)
 
-    if reader.is_encrypted:
-        reader.decrypt(password)
+        bytes_stream = BytesIO()
+        writer.write(bytes_stream)
+    decrypted = bytes_stream.getvalue()
+    results.put(key, decrypted)
+    return decrypted
+
+
+@instrument()
+@cache_by_fingerprint
+def remove_images(pdf: bytes, remove_images: bool, password: str) -> bytes:
+    reader = get_document(pdf, password).reader
+    record(pages=len(reader.pages))
 
     writer = PdfWriter()
 
@@ -405,56 +474,233 @@ def remove_images(pdf: bytes, remove_images: bool, password: str) -> bytes:
     return bytes_stream.getvalue()
 
 
+@instrument()
 def reduce_image_quality(pdf: bytes, quality: int, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
+    document = get_document(pdf, password)
+    record(pages=document.page_count)
+    return recompress_images(document.source, quality, password)[0]
 
-    if reader.is_encrypted:
-        reader.decrypt(password)
 
-    writer = PdfWriter()
+def display_image_report(report: pd.DataFrame, seconds: float) -> None:
+    before, after = report["Before (KB)"].sum(), report["After (KB)"].sum()
+    st.dataframe(report, hide_index=True)
+    st.caption(
+        f"{before:,.0f} KB → {after:,.0f} KB of images "
+        f"({(1 - after / before) if before else 0:.0%} saved) in {seconds:.1f}s"
+    )
 
-    for page in reader.pages:
-        writer.add_page(page)
 
-    writer.add_metadata(reader.metadata)
+@instrument()
+@cache_by_fingerprint
+def compress_pdf(pdf: bytes, password: str, object_streams: bool = False) -> bytes:
+    document = get_document(pdf, password)
+    record(pages=document.page_count)
+    return compress(document.source, password, object_streams=object_streams)[0]
 
-    for page in writer.pages:
-        for img in page.images:
-            img.replace(img.image, quality=quality)
 
-    bytes_stream = BytesIO()
-    writer.write(bytes_stream)
+def display_compression_report(
+    report: pd.DataFrame, size_before: int, size_after: int, seconds: float
+) -> None:
+    report = report.assign(Ratio=report["After (KB)"] / report["Before (KB)"])
+    st.dataframe(report, hide_index=True)
+    st.caption(
+        f"{size_before / 1024:,.0f} KB → {size_after / 1024:,.0f} KB "
+        f"({1 - size_after / size_before:.0%} saved) in {seconds:.1f}s"
+    )
 
-    bytes_stream.seek(0)
 
-    return bytes_stream.getvalue()
+@instrument()
+@cache_by_fingerprint
+def convert_pdf_to_word(pdf, page_numbers_str: str = "all") -> BytesIO:
+    pages = None if page_numbers_str == "all" else parse_page_numbers(page_numbers_str)
+    document = get_document(pdf, session_state.password)
+    record(pages=document.page_count if pages is None else len(pages))
+    docx = convert_to_docx(
+        document.source, document.digest, session_state.password, pages=pages
+    )
+    return BytesIO(docx)
 
 
-@st.cache_data
-def compress_pdf(pdf: bytes, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
+# Background jobs. Each submit_* call returns a job id at once; the same work
+# on the same document maps to the same job, so reruns and other sessions
+# find it queued, running or done instead of starting it again.
 
-    if reader.is_encrypted:
-        reader.decrypt(password)
 
-    writer = PdfWriter(clone_from=reader)
+def _job_params(password: Optional[str], **params) -> dict:
+    # Jobs are persisted: record which password was used, never the password
+    return params | {"secret": content_hash((password or "").encode())}
 
-    for page in writer.pages:
-        page.compress_content_streams()  # This is CPU intensive!
 
-    bytes_stream = BytesIO()
-    writer.write(bytes_stream)
-    bytes_stream.seek(0)
+def _job_table(report: pd.DataFrame) -> dict:
+    return {"columns": list(report.columns), "data": report.values.tolist()}
 
-    return bytes_stream.getvalue()
 
+def submit_compress(pdf, password: str, object_streams: bool = False) -> str:
+    document = get_document(pdf, password)
+    size_before = len(document.data)
 
-@st.cache_data
-def convert_pdf_to_word(pdf):
-    cv = Converter(stream=pdf, password=session_state.password)
-    docx_stream = BytesIO()
-    cv.convert(docx_stream, start=0, end=None)
-    cv.close()
-
-    docx_stream.seek(0)
-    return docx_stream
+    def task(source, progress, cancel) -> Tuple[bytes, dict]:
+        data, report, seconds = compress(
+            source, password, object_streams=object_streams, progress=progress
+        )
+        return data, {
+            "table": _job_table(report),
+            "size_before": size_before,
+            "seconds": seconds,
+        }
+
+    params = _job_params(password, object_streams=object_streams)
+    return get_queue().submit("compress_pdf", document.digest, params, document.source, task)
+
+
+def submit_reduce_image_quality(pdf, quality: int, password: str) -> str:
+    document = get_document(pdf, password)
+
+    def task(source, progress, cancel) -> Tuple[bytes, dict]:
+        data, report, seconds = recompress_images(source, quality, password, progress=progress)
+        return data, {"table": _job_table(report), "seconds": seconds}
+
+    params = _job_params(password, quality=quality)
+    return get_queue().submit(
+        "reduce_image_quality", document.digest, params, document.source, task
+    )
+
+
+def submit_convert_pdf_to_word(pdf, password: str, page_numbers_str: str = "all") -> str:
+    document = get_document(pdf, password)
+    digest = document.digest
+    pages = None if page_numbers_str == "all" else parse_page_numbers(page_numbers_str)
+
+    def task(source, progress, cancel) -> bytes:
+        return convert_to_docx(source, digest, password, pages, progress=progress, cancel=cancel)
+
+    params = _job_params(password, pages=page_numbers_str)
+    return get_queue().submit("convert_pdf_to_word", digest, params, document.source, task)
+
+
+def submit_extraction(
+    document: PdfDocument, terms: Sequence[str], resubmit: bool = False
+) -> str:
+    """Regex-then-LLM term extraction; read the result with `pipeline.from_json`.
+
+    The latest job for the same terms is returned whatever its status, so a
+    cancelled or failed extraction stays that way across reruns; `resubmit`
+    starts it again.
+    """
+    password, digest = document.password, document.digest
+    params = _job_params(password, terms=list(terms), model=llm.MODEL)
+    queue = get_queue()
+    job = queue.find("extract_terms", digest, params)
+    if job is not None and not resubmit and (job.status != "done" or queue.has_result(job.id)):
+        return job.id
+
+    def task(source, progress, cancel) -> bytes:
+        # Session state is out of reach here, so the job opens its own document
+        if isinstance(source, str):
+            job_document = PdfDocument.from_path(Path(source), password, digest)
+        else:
+            job_document = PdfDocument(source, password, digest)
+        try:
+            progress(0.1, "Matching patterns")
+            stats = pipeline.HybridStats()
+            # Reuses what an earlier revision of the same plan established
+            found = pipeline.extract_incremental(
+                job_document, terms, stats=stats, cancel=cancel
+            )
+            if errors := stats.usage.errors:
+                # Fail rather than finish, so partial answers are not taken as the result
+                raise RuntimeError(f"{len(errors)} OpenAI requests failed, first: {errors[0]}")
+            return pipeline.to_json(found, stats)
+        finally:
+            job_document.close()
+
+    return queue.submit("extract_terms", digest, params, document.source, task)
+
+
+# What to offer for download, by job kind
+JOB_DOWNLOADS = {
+    "compress_pdf": ("Compressed PDF", "compressed.pdf", "application/pdf"),
+    "reduce_image_quality": ("Reduced PDF", "reduced.pdf", "application/pdf"),
+    "convert_pdf_to_word": (
+        "Word document",
+        "converted.docx",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ),
+}
+
+
+def show_job(job_id: str, label: str, retry: Optional[Callable[[], str]] = None) -> Job:
+    """Progress of a job, polled in place with a Cancel button until it ends.
+
+    Polling reruns only this fragment; when the job ends the whole script
+    reruns once so the caller can show the result. A failed or cancelled job
+    gets a Retry button if `retry` is given, which submits the job again.
+    """
+    queue = get_queue()
+    job = queue.get(job_id)
+
+    @st.fragment(run_every=None if job.final else 1.0)
+    def poll() -> None:
+        current = queue.get(job_id)
+        if current.final != job.final:
+            st.rerun()
+        if not current.final:
+            col0, col1 = st.columns([4, 1])
+            col0.progress(current.progress, text=f"{label}: {current.message}")
+            if col1.button("Cancel", key=f"cancel_{job_id}"):
+                queue.cancel(job_id)
+        elif current.status in ("failed", "cancelled"):
+            if current.status == "failed":
+                st.error(f"{label} failed: {current.error}", icon="❌")
+            else:
+                st.info(f"{label} was cancelled.")
+            if retry is not None and st.button("Retry", key=f"retry_{job_id}"):
+                retry()
+                st.rerun()
+        elif current.kind in JOB_DOWNLOADS:
+            name, file_name, mime = JOB_DOWNLOADS[current.kind]
+            st.download_button(
+                f"Download {name.lower()} ({current.size / 1024:,.0f} KB)",
+                data=lambda: queue.result(job_id),
+                file_name=file_name,
+                mime=mime,
+                key=f"download_{job_id}",
+            )
+            if current.report is not None:
+                _show_job_report(current)
+
+        if current.final and current.spans:
+            with st.popover("Performance", key=f"spans_{job_id}"):
+                st.dataframe(pd.DataFrame(current.spans, columns=COLUMNS), hide_index=True)
+
+    poll()
+    return job
+
+
+def _show_job_report(job: Job) -> None:
+    table = job.report["table"]
+    report = pd.DataFrame(table["data"], columns=table["columns"])
+    if job.kind == "compress_pdf":
+        display_compression_report(
+            report, job.report["size_before"], job.size, job.report["seconds"]
+        )
+    elif job.kind == "reduce_image_quality":
+        display_image_report(report, job.report["seconds"])
+
+
+def document_jobs(digest: str, password: Optional[str]) -> List[Job]:
+    """The latest export job of each kind and parameters run on this document
+    with the same password, newest first, by any session."""
+    secret = _job_params(password)["secret"]
+    jobs, seen = [], set()
+    for job in get_queue().for_document(digest):
+        key = (job.kind, str(job.params))
+        if job.kind in JOB_DOWNLOADS and job.params["secret"] == secret and key not in seen:
+            seen.add(key)
+            jobs.append(job)
+    return jobs
+
+
+def show_document_jobs(digest: str, password: Optional[str]) -> None:
+    for job in document_jobs(digest, password):
+        show_job(job.id, JOB_DOWNLOADS[job.kind][0])
@@ -0,0 +1,309 @@
+import hashlib
+import re
+import time
+import zipfile
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, IndirectObject, NameObject, NumberObject
+
+from utils.workers import PdfSource, open_source, process_pool
+
+# Images smaller than this are not worth re-encoding
+MIN_IMAGE_BYTES = 10 * 1024
+# JPEGs already at or below this many bits per pixel are left alone
+LOW_BITS_PER_PIXEL = 1.0
+# Below this many images, encoding in-process beats starting a pool
+PARALLEL_MIN_IMAGES = 4
+
+Progress = Callable[[float, str], None]
+
+# Reader of a pool worker process, opened once by the pool initializer. The
+# in-process path passes its own reader instead, as threads share this global.
+_reader: Optional[PdfReader] = None
+
+
+def _open(pdf: PdfSource, password: str) -> None:
+    global _reader
+    _reader = PdfReader(open_source(pdf))
+    if _reader.is_encrypted:
+        _reader.decrypt(password)
+
+
+def _encode_with(
+    reader: PdfReader, job: Tuple[int, int, List[str], int]
+) -> Tuple[int, Optional[bytes], str, int, int, str]:
+    """Decode one image XObject and re-encode it as JPEG at `quality`."""
+    idnum, page_index, key, quality = job
+    image = reader.pages[page_index].images[key if len(key) > 1 else key[0]].image
+
+    # Alpha comes from the /SMask, which is kept as is
+    image = {"RGBA": image.convert("RGB"), "LA": image.convert("L")}.get(image.mode, image)
+    if image.mode in ("P", "CMYK"):
+        image = image.convert("RGB")
+    if image.mode not in ("RGB", "L"):
+        return idnum, None, f"skipped: {image.mode} image", 0, 0, ""
+
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    colorspace = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+    return idnum, buffer.getvalue(), "recompressed", image.width, image.height, colorspace
+
+
+def _encode(
+    job: Tuple[int, int, List[str], int]
+) -> Tuple[int, Optional[bytes], str, int, int, str]:
+    return _encode_with(_reader, job)
+
+
+def _walk_xobjects(
+    resources, path: List[str], forms: Set[int]
+) -> Iterator[Tuple[List[str], IndirectObject]]:
+    """Yield `(name path, reference)` of the image XObjects under `resources`.
+
+    Form XObjects are descended into, each once, so the path of a nested
+    image is the names of its forms followed by its own, as `page.images`
+    keys it.
+    """
+    xobjects = resources.get("/XObject", {})
+    for name in xobjects:
+        ref = xobjects.raw_get(name)
+        if not isinstance(ref, IndirectObject):
+            continue
+        obj = ref.get_object()
+        if obj.get("/Subtype") == "/Form" and ref.idnum not in forms:
+            forms.add(ref.idnum)
+            yield from _walk_xobjects(obj.get("/Resources", {}), path + [str(name)], forms)
+        elif obj.get("/Subtype") == "/Image":
+            yield path + [str(name)], ref
+
+
+def _image_xobjects(writer: PdfWriter) -> Dict[int, dict]:
+    """Unique image XObjects by object number, with the pages that use them."""
+    images: Dict[int, dict] = {}
+    for page_index, page in enumerate(writer.pages):
+        for key, ref in _walk_xobjects(page.get("/Resources", {}), [], set()):
+            obj = ref.get_object()
+            if ref.idnum in images:
+                if page_index + 1 not in images[ref.idnum]["pages"]:
+                    images[ref.idnum]["pages"].append(page_index + 1)
+                continue
+            images[ref.idnum] = {
+                "ref": ref,
+                "obj": obj,
+                "page_index": page_index,
+                "key": key,
+                "name": "".join(key),
+                "pages": [page_index + 1],
+                "before": len(obj._data),
+            }
+    return images
+
+
+def _skip_reason(obj, size: int, min_bytes: int) -> Optional[str]:
+    if obj.get("/ImageMask"):
+        return "skipped: stencil mask"
+    if size < min_bytes:
+        return "skipped: small"
+    filters = obj.get("/Filter")
+    if filters == "/DCTDecode" or filters == ["/DCTDecode"]:
+        pixels = int(obj.get("/Width", 0)) * int(obj.get("/Height", 0))
+        if pixels and size * 8 / pixels <= LOW_BITS_PER_PIXEL:
+            return "skipped: already compressed"
+    return None
+
+
+def recompress_images(
+    pdf: PdfSource,
+    quality: int,
+    password: str = "",
+    workers: Optional[int] = None,
+    min_bytes: int = MIN_IMAGE_BYTES,
+    progress: Optional[Progress] = None,
+) -> Tuple[bytes, pd.DataFrame, float]:
+    """Re-encode the images of `pdf` as JPEG at `quality`.
+
+    Each image XObject is encoded once however many pages share it, small or
+    already well-compressed ones are skipped, and encodes that would grow an
+    image are discarded. `progress(fraction, text)` is called as images are
+    done. Returns the new PDF, a per-image report, and the elapsed seconds.
+    """
+    progress = progress or (lambda fraction, text: None)
+    start = time.perf_counter()
+    with open_source(pdf) as source:
+        reader = PdfReader(source)
+        if reader.is_encrypted:
+            reader.decrypt(password)
+
+        writer = PdfWriter()
+        for page in reader.pages:
+            writer.add_page(page)
+        writer.add_metadata(reader.metadata or {})
+
+        images = _image_xobjects(writer)
+        jobs = []
+        for idnum, image in images.items():
+            image["action"] = _skip_reason(image["obj"], image["before"], min_bytes)
+            if image["action"] is None:
+                jobs.append((idnum, image["page_index"], image["key"], quality))
+
+        if len(jobs) >= PARALLEL_MIN_IMAGES and workers != 1:
+            pool = process_pool(workers, _open, (pdf, password))
+            results = pool.map(_encode, jobs, chunksize=4)
+        else:
+            pool = None
+            results = map(partial(_encode_with, reader), jobs)
+
+        try:
+            for done, result in enumerate(results, start=1):
+                progress(0.9 * done / len(jobs), f"Re-encoded {done} of {len(jobs)} images")
+                idnum, data, action, width, height, colorspace = result
+                image = images[idnum]
+                image["action"] = action
+                if data is None:
+                    continue
+                if len(data) >= image["before"]:
+                    image["action"] = "skipped: no gain"
+                    continue
+
+                obj = image["obj"]
+                stream = DecodedStreamObject()
+                stream.set_data(data)
+                stream.update(
+                    {
+                        NameObject("/Type"): NameObject("/XObject"),
+                        NameObject("/Subtype"): NameObject("/Image"),
+                        NameObject("/Width"): NumberObject(width),
+                        NameObject("/Height"): NumberObject(height),
+                        NameObject("/ColorSpace"): NameObject(colorspace),
+                        NameObject("/BitsPerComponent"): NumberObject(8),
+                        NameObject("/Filter"): NameObject("/DCTDecode"),
+                    }
+                )
+                for key in ("/SMask", "/Interpolate", "/Intent"):
+                    if key in obj:
+                        stream[NameObject(key)] = obj.raw_get(key)
+                writer._replace_object(image["ref"], stream)
+                image["after"] = len(data)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        progress(0.95, "Writing")
+        bytes_stream = BytesIO()
+        writer.write(bytes_stream)
+
+    report = pd.DataFrame(
+        [
+            {
+                "Object": idnum,
+                "Image": image["name"],
+                "Pages": ", ".join(map(str, image["pages"])),
+                "Before (KB)": image["before"] / 1024,
+                "After (KB)": image.get("after", image["before"]) / 1024,
+                "Action": image["action"],
+            }
+            for idnum, image in images.items()
+        ],
+        columns=["Object", "Image", "Pages", "Before (KB)", "After (KB)", "Action"],
+    )
+    progress(1.0, "Done")
+    return bytes_stream.getvalue(), report, time.perf_counter() - start
+
+
+class ImageRecord(NamedTuple):
+    name: str
+    page: int  # 1-based page the image was first found on
+    size: int  # Bytes written
+    digest: str
+    path: str  # Path of the written file, or member name in the target zip
+
+
+def _xobject_id(page, key: Union[str, List[str]]) -> Optional[int]:
+    """Object number of the image XObject at `key`; None for inline images."""
+    obj = page
+    for name in key if isinstance(key, list) else [key]:
+        xobjects = obj.get("/Resources", {}).get("/XObject", {})
+        if name not in xobjects:
+            return None
+        ref = xobjects.raw_get(name)
+        obj = ref.get_object()
+    return ref.idnum if isinstance(ref, IndirectObject) else None
+
+
+def iter_images(
+    reader: PdfReader, pages: Iterable[int]
+) -> Iterator[Tuple[int, Any]]:
+    """Yield `(page_number, image)` for 0-based `pages`, decoding each XObject once.
+
+    Images are pypdf's `ImageFile`s, which pypdf does not export publicly.
+    """
+    seen = set()
+    for page_index in pages:
+        page = reader.pages[page_index]
+        for key in page.images.keys():
+            idnum = _xobject_id(page, key)
+            if idnum is not None:
+                if idnum in seen:
+                    continue
+                seen.add(idnum)
+            yield page_index + 1, page.images[key]
+
+
+def save_images(
+    reader: PdfReader, pages: Iterable[int], target: Union[str, Path]
+) -> List[ImageRecord]:
+    """Write each distinct image to `target` as it is decoded.
+
+    `target` is a directory, or a .zip archive. Images are deduplicated by
+    XObject before decoding and by content digest after, and only one image
+    is held in memory at a time.
+    """
+    target = Path(target)
+    archive = None
+    if target.suffix.lower() == ".zip":
+        target.parent.mkdir(parents=True, exist_ok=True)
+        archive = zipfile.ZipFile(target, "w", zipfile.ZIP_STORED)
+    else:
+        target.mkdir(parents=True, exist_ok=True)
+
+    records: List[ImageRecord] = []
+    digests, paths = set(), set()
+    try:
+        for page, image in iter_images(reader, pages):
+            data = image.data
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            if digest in digests:
+                continue
+            digests.add(digest)
+
+            path = f"page{page:04d}_" + re.sub(r"[^\w.-]", "_", image.name)
+            if path in paths:  # Same name in two forms on one page
+                path = f"page{page:04d}_{digest[:8]}_" + path.split("_", 1)[1]
+            paths.add(path)
+            if archive is not None:
+                archive.writestr(path, data)
+            else:
+                path = str(target / path)
+                Path(path).write_bytes(data)
+            records.append(ImageRecord(image.name, page, len(data), digest, path))
+    finally:
+        if archive is not None:
+            archive.close()
+    return records
@@ -2,11 +2,6 @@ from streamlit import session_state
 
 
 def init():
-    session_state["decrypted_filename"] = (
-        None
-        if "decrypted_filename" not in session_state
-        else session_state["decrypted_filename"]
-    )
     session_state["password"] = (
         "" if "password" not in session_state else session_state["password"]
     )
@@ -0,0 +1,349 @@
+import contextvars
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from utils import metrics
+from utils.workers import PdfSource
+
+DEFAULT_DIR = Path(
+    os.getenv("JOBS_PATH", Path.home() / ".cache" / "pdf-workdesk" / "jobs")
+)
+# Jobs run at once across all sessions; heavy ones fan out to process pools
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Progress is written to the database at most this often per job
+PROGRESS_INTERVAL = 0.5
+
+FINAL = ("done", "failed", "cancelled")
+# Columns added after the table was first created, added to older databases
+# on startup
+ADDED_COLUMNS = ("spans TEXT", "report TEXT", "owner TEXT")
+# The process running a job. The pid alone is not enough: a restarted
+# container often gets the pid its previous process had.
+OWNER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+Progress = Callable[[float, str], None]
+# A job's work on its PDF: reports progress (which raises once cancelled),
+# returns the result, or the result and a JSON-serialisable report on it
+Task = Callable[[PdfSource, Progress, threading.Event], Union[bytes, Tuple[bytes, dict]]]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(NamedTuple):
+    id: str
+    kind: str
+    fingerprint: str
+    params: dict
+    status: str  # "queued", "running", "done", "failed" or "cancelled"
+    progress: float
+    message: str
+    error: Optional[str]
+    created: float
+    started: Optional[float]
+    finished: Optional[float]
+    size: Optional[int]  # Bytes of the result, once done
+    spans: List[dict]  # Rows of the job's metrics run, once it ends
+    report: Optional[dict]  # What the task reported with its result
+
+    @property
+    def final(self) -> bool:
+        return self.status in FINAL
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that ran jobs as `owner` is still running."""
+    if owner is None:
+        return False
+    if owner == OWNER:
+        return True
+    pid = owner.split("-")[0]
+    if pid == OWNER.split("-")[0]:  # An earlier process that had our pid
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Alive, run by another user
+        return True
+    return True
+
+
+def job_key(kind: str, fingerprint: str, params: dict) -> str:
+    payload = json.dumps([kind, fingerprint, params], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class JobQueue:
+    """Runs tasks on a thread pool, with their state persisted in SQLite.
+
+    A job is identified by its kind, document fingerprint and parameters;
+    submitting the same work again returns the existing job while it is
+    queued, running or done, so results are found by fingerprint across
+    sessions and restarts. Results are stored as files next to the database
+    and dropped after `max_age` seconds.
+
+    A PDF given by path, such as a spooled upload, is linked or copied into
+    the queue's directory when the job is submitted. The session may delete
+    its own file while the job still waits or runs.
+
+    Processes may share the directory. Each runs only the jobs it was given,
+    and on startup fails the unfinished jobs of processes no longer running.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path] = DEFAULT_DIR,
+        workers: int = JOB_WORKERS,
+        max_age: float = 7 * 24 * 3600,
+    ):
+        self.directory = Path(directory)
+        self.results = self.directory / "results"
+        self.results.mkdir(parents=True, exist_ok=True)
+        # Inputs of processes no longer running, whose jobs are failed below
+        for entry in (self.directory / "inputs").glob("*"):
+            if not entry.is_dir():  # From before inputs were kept per process
+                entry.unlink(missing_ok=True)
+            elif not _owner_alive(entry.name):
+                shutil.rmtree(entry, ignore_errors=True)
+        self.inputs = self.directory / "inputs" / OWNER
+        self.inputs.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._futures: Dict[str, Future] = {}
+        self._cancel: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(
+            str(self.directory / "jobs.sqlite"), check_same_thread=False
+        )
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL,
+                message TEXT NOT NULL,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+            CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint);
+            """
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column in ADDED_COLUMNS:
+            if column.split()[0] not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        # Jobs of a process no longer running can neither finish nor be resumed
+        unfinished = self._conn.execute(
+            "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+        self._conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart' "
+            "WHERE id = ?",
+            [(job_id,) for job_id, owner in unfinished if not _owner_alive(owner)],
+        )
+        self._conn.commit()
+        self.prune()
+
+    def _update(self, job_id: str, **fields) -> None:
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+            self._conn.commit()
+
+    def _select(self, where: str, args: tuple) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, fingerprint, params, status, progress, message, error, "
+                f"created, started, finished, size, spans, report FROM jobs WHERE {where} "
+                "ORDER BY created DESC",
+                args,
+            ).fetchall()
+        return [
+            Job(
+                *row[:3],
+                json.loads(row[3]),
+                *row[4:12],
+                json.loads(row[12] or "[]"),
+                json.loads(row[13]) if row[13] else None,
+            )
+            for row in rows
+        ]
+
+    def submit(
+        self, kind: str, fingerprint: str, params: dict, source: PdfSource, task: Task
+    ) -> str:
+        """Queue `task` on `source` unless the same job is already queued, running or done."""
+        key = job_key(kind, fingerprint, params)
+        for job in self._select("key = ?", (key,)):
+            if job.status in ("queued", "running") or (
+                job.status == "done" and self.has_result(job.id)
+            ):
+                return job.id
+
+        job_id = uuid.uuid4().hex
+        if isinstance(source, str):
+            source = self._hold(source, job_id)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, key, kind, fingerprint, params, status, progress, "
+                "message, created, owner) VALUES (?, ?, ?, ?, ?, 'queued', 0, 'Queued', ?, ?)",
+                (job_id, key, kind, fingerprint, json.dumps(params), time.time(), OWNER),
+            )
+            self._conn.commit()
+            self._cancel[job_id] = threading.Event()
+            # A context of its own, so the job's spans are collected into its
+            # own run rather than lost on the pool's thread
+            self._futures[job_id] = self._executor.submit(
+                contextvars.Context().run, self._run, job_id, kind, source, task
+            )
+        return job_id
+
+    def _hold(self, path: str, job_id: str) -> str:
+        held = self.inputs / job_id
+        try:
+            os.link(path, held)
+        except OSError:  # Another file system, most likely
+            shutil.copyfile(path, held)
+        return str(held)
+
+    def _release(self, job_id: str) -> None:
+        (self.inputs / job_id).unlink(missing_ok=True)
+
+    def _run(self, job_id: str, kind: str, source: PdfSource, task: Task) -> None:
+        cancel = self._cancel[job_id]
+        if cancel.is_set():
+            self._release(job_id)
+            return
+        self._update(job_id, status="running", started=time.time(), message="Starting")
+        run = metrics.start_run()
+        last = 0.0
+
+        def progress(fraction: float, text: str) -> None:
+            nonlocal last
+            if cancel.is_set():
+                raise JobCancelled()
+            now = time.monotonic()
+            if now - last >= PROGRESS_INTERVAL or fraction >= 1:
+                last = now
+                self._update(job_id, progress=fraction, message=text)
+
+        try:
+            with metrics.span(kind):
+                data = task(source, progress, cancel)
+            if cancel.is_set():
+                raise JobCancelled()
+            data, report = data if isinstance(data, tuple) else (data, None)
+            self._path(job_id).write_bytes(data)
+            self._update(
+                job_id,
+                status="done",
+                progress=1.0,
+                message="Done",
+                finished=time.time(),
+                size=len(data),
+                spans=json.dumps(run.rows()),
+                report=None if report is None else json.dumps(report),
+            )
+        except JobCancelled:
+            self._update(
+                job_id,
+                status="cancelled",
+                message="Cancelled",
+                finished=time.time(),
+                spans=json.dumps(run.rows()),
+            )
+        except Exception as e:
+            self._update(
+                job_id,
+                status="failed",
+                message="Failed",
+                error=f"{type(e).__name__}: {e}",
+                finished=time.time(),
+                spans=json.dumps(run.rows()),
+            )
+        finally:
+            self._release(job_id)
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._cancel.pop(job_id, None)
+
+    def _path(self, job_id: str) -> Path:
+        return self.results / job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        jobs = self._select("id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def find(self, kind: str, fingerprint: str, params: dict) -> Optional[Job]:
+        """Latest job for this work on this document, whatever its status."""
+        jobs = self._select("key = ?", (job_key(kind, fingerprint, params),))
+        return jobs[0] if jobs else None
+
+    def for_document(self, fingerprint: str) -> List[Job]:
+        return self._select("fingerprint = ?", (fingerprint,))
+
+    def result(self, job_id: str) -> Optional[bytes]:
+        path = self._path(job_id)
+        return path.read_bytes() if path.exists() else None
+
+    def has_result(self, job_id: str) -> bool:
+        return self._path(job_id).exists()
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job, or stop a running one at its next progress report."""
+        with self._lock:
+            cancel, future = self._cancel.get(job_id), self._futures.get(job_id)
+        if cancel is None:
+            return False
+        cancel.set()
+        if future is not None and future.cancel():
+            # Never started, so _run will not record it
+            self._update(job_id, status="cancelled", message="Cancelled", finished=time.time())
+            self._release(job_id)
+        return True
+
+    def prune(self) -> None:
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT id FROM jobs WHERE created < ? AND status IN (?, ?, ?)",
+                (cutoff, *FINAL),
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", old)
+            self._conn.commit()
+        for (job_id,) in old:
+            self._path(job_id).unlink(missing_ok=True)
+
+
+_default_queue: Optional[JobQueue] = None
+_default_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _default_queue
+    with _default_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+        return _default_queue
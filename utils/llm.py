@@ -0,0 +1,308 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import openai
+from pypdf import PdfReader
+
+from utils.chunking import Chunk, chunk_pages, count_tokens, select_chunks
+from utils.llm_cache import ResponseCache, cache_key, get_default_cache
+from utils.metrics import instrument, record
+from utils.scheduler import RequestScheduler
+
+MODEL = "gpt-4"
+MAX_TOKENS = 1500
+
+# Request scheduling; set OPENAI_API_BASE to a `python -m utils.stub_server`
+# address to exercise it without the real API
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "40000"))
+
+# Chunk size, and how many of the most relevant chunks are sent per term
+CHUNK_TOKENS = 1500
+TOP_K = 3
+
+# Terms we ask the model for, with the response options shown in parentheses
+TERM_OPTIONS: Dict[str, str] = {
+    "Plan name": "free text",
+    "Trustee": "free text",
+    "EIN": "integers",
+    "Year End": "date",
+    "Entity Type": "C corp, S corp, non profit, partnership, LLC taxed as a s corp, "
+    "LLC taxed as a c corp, LLC taxed as sole proprietor, Limited Liability Partnership, "
+    "Sole Proprietorship, union, government agency, other",
+    "Entity State": "free text",
+    "Is it a safe harbor": "No, Yes - safe harbor match, Yes - nonelective contribution, "
+    "Yes - QACA safe harbor match, Yes - enhanced safe harbor match, "
+    "Yes - QACA nonelective contribution",
+    "Vesting": "100% Vested, 2 - 6 Year Graded, 1 - 5 Year Graded, 2 Year 50/50, "
+    "1 - 4 Year Graded, 3 Year Cliff, 2 Year Cliff, 1 Year Cliff",
+    "Profit sharing vesting": "100% Vested, 2 - 6 Year Graded, 1 - 5 Year Graded, "
+    "2 Year 50/50, 1 - 4 Year Graded, 3 Year Cliff, 2 Year Cliff, 1 Year Cliff",
+    "Plan Type": "free text",
+}
+
+TERMS = list(TERM_OPTIONS)
+
+# Words that point at the chunks likely to answer each term
+TERM_KEYWORDS: Dict[str, List[str]] = {
+    "Plan name": ["plan", "name"],
+    "Trustee": ["trustee", "trustees"],
+    "EIN": ["ein", "employer", "identification", "number", "tax"],
+    "Year End": ["plan", "year", "end", "fiscal", "limitation"],
+    "Entity Type": ["entity", "type", "corporation", "partnership", "llc", "proprietorship"],
+    "Entity State": ["state", "organized", "incorporated", "principal", "office"],
+    "Is it a safe harbor": ["safe", "harbor", "qaca", "nonelective", "match"],
+    "Vesting": ["vesting", "vested", "schedule", "graded", "cliff"],
+    "Profit sharing vesting": ["profit", "sharing", "vesting", "nonelective", "graded", "cliff"],
+    "Plan Type": ["plan", "type", "401k", "profit", "sharing"],
+}
+
+PROMPT_TEMPLATE = """
+    Pull the following in a table with the following columns:
+    Term | Response | Page number
+
+    Here are the {count} things we need with the response options in parentheses:
+    {terms}
+
+    Leave the Response empty if the text does not answer a term.
+
+    {text}
+    """
+
+# Responses the model uses when a term is not answered by the chunk
+_EMPTY_RESPONSES = {"", "-", "n/a", "na", "none", "not found", "not mentioned", "unknown"}
+
+
+@dataclass
+class UsageStats:
+    calls: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Requests that failed, so that a term left empty by one is not read as absent
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, usage) -> None:
+        self.calls += 1
+        if usage:
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+
+
+_OPTIONS_BY_NAME = {term.lower(): options for term, options in TERM_OPTIONS.items()}
+_KEYWORDS_BY_NAME = {term.lower(): words for term, words in TERM_KEYWORDS.items()}
+
+
+def build_prompt(text: str, terms: Sequence[str]) -> str:
+    term_lines = "\n    ".join(
+        f"{term} ({options})" if (options := _OPTIONS_BY_NAME.get(term.lower())) else term
+        for term in terms
+    )
+    return PROMPT_TEMPLATE.format(count=len(terms), terms=term_lines, text=text)
+
+
+def format_chunk(pages: Sequence[Tuple[int, str]]) -> str:
+    # Mark page boundaries so the model can fill in the "Page number" column
+    return "\n\n".join(f"[Page {page_num}]\n{text}" for page_num, text in pages)
+
+
+@instrument("openai_completion")
+def complete(prompt: str) -> Tuple[str, dict]:
+    response = openai.Completion.create(
+        model=MODEL,
+        prompt=prompt,
+        max_tokens=MAX_TOKENS,
+        temperature=0.5,
+        n=1,
+        stop=None,
+    )
+    usage = response.get("usage") or {}
+    record(tokens=usage.get("total_tokens", 0))
+    return response.choices[0].text.strip(), usage
+
+
+def default_scheduler(processes: int = 1) -> RequestScheduler:
+    """A scheduler for one of `processes` processes sharing the rate limits evenly."""
+    return RequestScheduler(
+        max_concurrency=max(1, MAX_CONCURRENCY // processes),
+        tokens_per_minute=max(1, TOKENS_PER_MINUTE // processes),
+        retry_on=(openai.error.RateLimitError, openai.error.ServiceUnavailableError),
+    )
+
+
+def parse_response_table(
+    response: str, terms: Sequence[str], default_page: Optional[int] = None
+) -> Dict[str, Tuple[str, Optional[int]]]:
+    """Parse `Term | Response | Page number` rows into {term: (response, page)}."""
+    lookup = {term.lower(): term for term in terms}
+    rows = {}
+
+    for line in response.splitlines():
+        cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+        if len(cells) < 2:
+            continue
+
+        term = lookup.get(cells[0].strip("*").lower())
+        value = cells[1]
+        if term is None or term in rows or value.lower() in _EMPTY_RESPONSES:
+            continue
+
+        page = default_page
+        if len(cells) > 2 and (match := re.search(r"\d+", cells[2])):
+            page = int(match.group())
+        rows[term] = (value, page)
+
+    return rows
+
+
+@instrument()
+def extract_relevant_information(
+    pdf_reader: Union[PdfReader, Sequence[str]],
+    terms: Sequence[str],
+    stats: Optional[UsageStats] = None,
+    scheduler: Optional[RequestScheduler] = None,
+    cache: Optional[ResponseCache] = None,
+    chunk_tokens: int = CHUNK_TOKENS,
+    top_k: Optional[int] = TOP_K,
+    pages: Optional[Iterable[int]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> List[list]:
+    """Query the LLM for `terms`, sending each chunk once with the terms it may answer.
+
+    `pdf_reader` may also be the text of each page, extracted already, as in
+    a document's page index. Pages are regrouped into chunks of about `chunk_tokens`; each term is only
+    asked of its `top_k` most relevant chunks (all chunks when `top_k` is None).
+    `pages` limits the search to those 1-based page numbers. Once `cancel` is
+    set no further requests go out, and the terms answered so far are returned.
+
+    Each term gets the answer from its earliest page: requests stop once every
+    term is answered, but not before the earlier chunks in flight are back.
+    Failed requests are listed in `stats.errors` and the other terms are still
+    returned; without `stats`, the first failure is raised at the end.
+    """
+    scheduler = scheduler or default_scheduler()
+    cache = cache or get_default_cache()
+    info_data: Dict[str, Optional[Tuple[str, Optional[int]]]] = {
+        term: None for term in terms
+    }
+
+    if isinstance(pdf_reader, PdfReader):
+        page_count = len(pdf_reader.pages)
+
+        def page_text(page_num: int) -> str:
+            return pdf_reader.pages[page_num - 1].extract_text()
+
+    else:
+        page_count = len(pdf_reader)
+
+        def page_text(page_num: int) -> str:
+            return pdf_reader[page_num - 1]
+
+    page_numbers = sorted(pages) if pages is not None else range(1, page_count + 1)
+    record(pages=len(page_numbers))
+    chunks = chunk_pages(
+        ((page_num, page_text(page_num)) for page_num in page_numbers), chunk_tokens
+    )
+    if top_k is None:
+        selected = {i: list(terms) for i in range(len(chunks))}
+    else:
+        selected = select_chunks(
+            chunks,
+            {term: _KEYWORDS_BY_NAME.get(term.lower(), term.split()) for term in terms},
+            top_k,
+        )
+
+    def cancelled() -> bool:
+        return cancel is not None and cancel.is_set()
+
+    def pending(chunk_terms: Sequence[str] = terms) -> List[str]:
+        return [term for term in chunk_terms if info_data[term] is None]
+
+    # Chunk each term was answered from, and chunks sent but not back yet
+    answered_in: Dict[str, int] = {}
+    outstanding: Dict[int, Sequence[str]] = {}
+    errors: List[str] = []
+
+    def done() -> bool:
+        # A chunk still out can only matter if it comes before a term's answer
+        return cancelled() or (
+            not pending()
+            and not any(
+                i < answered_in[term]
+                for i, chunk_terms in outstanding.items()
+                for term in chunk_terms
+                if term in answered_in
+            )
+        )
+
+    def key(chunk: Chunk, chunk_terms: Sequence[str]) -> str:
+        return cache_key(format_chunk(chunk), chunk_terms, PROMPT_TEMPLATE, MODEL)
+
+    def merge(i: int, chunk: Chunk, chunk_terms: Sequence[str], response: str) -> None:
+        # Requests finish out of order; keep the answer from the earliest page
+        for term, (value, page) in parse_response_table(
+            response, chunk_terms, chunk[0][0]
+        ).items():
+            current = info_data[term]
+            if current is None or (page or 0) < (current[1] or 0):
+                info_data[term] = (value, page)
+            answered_in[term] = min(i, answered_in.get(term, i))
+
+    def jobs():
+        # In chunk order, so every chunk before an answer has been sent already
+        for i, chunk_terms in sorted(selected.items()):
+            chunk = chunks[i]
+            # Cached chunks are answered here and never reach the scheduler
+            if still_pending := pending(chunk_terms):
+                if cached := cache.get(key(chunk, still_pending)):
+                    if stats is not None:
+                        stats.cache_hits += 1
+                    merge(i, chunk, still_pending, cached[0])
+                    continue
+            outstanding[i] = chunk_terms
+            yield i, chunk, chunk_terms
+
+    def request(job):
+        # Built when the request is dispatched, so terms resolved meanwhile are left out
+        _, chunk, chunk_terms = job
+        if not (chunk_terms := pending(chunk_terms)):
+            return None
+        return chunk_terms, complete(build_prompt(format_chunk(chunk), chunk_terms))
+
+    def cost(job) -> int:
+        return count_tokens(format_chunk(job[1])) + MAX_TOKENS
+
+    for (i, chunk, _), result, error in scheduler.run(jobs(), request, cost=cost, is_done=done):
+        outstanding.pop(i, None)
+        if error is not None:
+            print(f"Error querying OpenAI: {error}")
+            errors.append(f"{type(error).__name__}: {error}")
+            continue
+        if result is None:
+            continue
+
+        chunk_terms, (response, usage) = result
+        if stats is not None:
+            stats.add(usage)
+        cache.put(key(chunk, chunk_terms), response, usage)
+        merge(i, chunk, chunk_terms, response)
+
+    if stats is not None:
+        stats.errors.extend(errors)
+    elif errors:
+        raise RuntimeError(f"{len(errors)} OpenAI requests failed, first: {errors[0]}")
+    return [
+        [
+            term,
+            info_data[term][0] if info_data[term] else "",
+            info_data[term][1] if info_data[term] else "",
+        ]
+        for term in terms
+    ]
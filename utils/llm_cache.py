@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple, Union
+
+DEFAULT_PATH = Path(
+    os.getenv("LLM_CACHE_PATH", Path.home() / ".cache" / "pdf-workdesk" / "llm.sqlite")
+)
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text: str, terms: Iterable[str], template: str, model: str) -> str:
+    digest = hashlib.sha256()
+    for part in (normalize_text(text), "\x1f".join(sorted(terms)), template, model):
+        digest.update(part.encode())
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed store of completion responses keyed by `cache_key`.
+
+    Entries older than `max_age` seconds are dropped, and the least recently
+    used ones are evicted once `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path] = DEFAULT_PATH,
+        max_entries: int = 50_000,
+        max_bytes: int = 200 * 1024**2,
+        max_age: float = 30 * 24 * 3600,
+        evict_every: int = 100,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[Tuple[str, dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, usage, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[2] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, response: str, usage: dict) -> None:
+        usage_json = json.dumps(dict(usage))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, usage_json, len(response) + len(usage_json), now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            conn = self._conn
+            conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            )
+            count, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if count > self.max_entries or size > self.max_bytes:
+                # Walk from least recently used until both limits are met
+                drop, keys = 0, []
+                for key, entry_size in conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ):
+                    if count - len(keys) <= self.max_entries and size - drop <= self.max_bytes:
+                        break
+                    keys.append((key,))
+                    drop += entry_size
+                conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> ResponseCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
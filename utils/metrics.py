@@ -0,0 +1,251 @@
+import contextvars
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+import pandas as pd
+import streamlit as st
+
+T = TypeVar("T")
+
+# Exact allocation peaks per span. tracemalloc slows Python-heavy stages such
+# as pypdf text extraction about 4x, so by default a span's memory is how far
+# it raised the process's peak RSS instead.
+TRACE_MEMORY = os.getenv("METRICS_TRACE_MEMORY") == "1"
+# Prometheus text rewritten after every run, e.g. for node_exporter's
+# textfile collector
+TEXTFILE = os.getenv("METRICS_TEXTFILE")
+
+
+@dataclass
+class Span:
+    name: str
+    parent: Optional[str] = None
+    started: float = 0.0  # Unix time
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0  # This thread only; worker processes are not included
+    peak_mb: float = 0.0
+    pages: int = 0
+    tokens: int = 0
+    error: Optional[str] = None
+    _outer: Optional["Span"] = field(default=None, repr=False)
+    _base: int = field(default=0, repr=False)
+    _high: int = field(default=0, repr=False)
+
+
+# Exported columns; the underscored fields only track nesting and memory
+COLUMNS = [f.name for f in fields(Span) if not f.name.startswith("_")]
+
+
+@dataclass
+class Totals:
+    calls: int = 0
+    errors: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_mb: float = 0.0
+    pages: int = 0
+    tokens: int = 0
+
+
+class Run:
+    """Spans finished during one script run, in the order they finished."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def rows(self) -> List[dict]:
+        with self._lock:
+            return [{column: getattr(s, column) for column in COLUMNS} for s in self.spans]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.rows(), columns=COLUMNS)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "started": self.started,
+                "memory": "tracemalloc" if TRACE_MEMORY else "rss",
+                "spans": self.rows(),
+            },
+            indent=2,
+        )
+
+
+_run: contextvars.ContextVar[Optional[Run]] = contextvars.ContextVar("run", default=None)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+# Process-wide totals per span name, exported for Prometheus
+_totals: Dict[str, Totals] = {}
+_lock = threading.Lock()
+# Spans open on any thread while tracing memory; tracemalloc's peak is global
+_open: List[Span] = []
+
+
+def start_run() -> Run:
+    """Collect the spans of this script run (and threads started from it)."""
+    run = Run()
+    _run.set(run)
+    return run
+
+
+def current_run() -> Optional[Run]:
+    return _run.get()
+
+
+def _max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _fold_peak() -> int:
+    # Credit the peak since the last reset to every open span, then reset it
+    current, peak = tracemalloc.get_traced_memory()
+    for span in _open:
+        span._high = max(span._high, peak)
+    tracemalloc.reset_peak()
+    return current
+
+
+@contextmanager
+def span(name: str) -> Iterator[Span]:
+    """Time the block as `name`: wall and CPU time, peak memory, pages and tokens."""
+    outer = _span.get()
+    current = Span(name, outer.name if outer else None, time.time(), _outer=outer)
+    if TRACE_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        with _lock:
+            current._base = current._high = _fold_peak()
+            _open.append(current)
+    else:
+        current._base = _max_rss()
+    token = _span.set(current)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.wall_seconds = time.perf_counter() - wall
+        current.cpu_seconds = time.thread_time() - cpu
+        _span.reset(token)
+        with _lock:
+            if TRACE_MEMORY:
+                _fold_peak()
+                _open.remove(current)
+                current.peak_mb = (current._high - current._base) / 1024**2
+            else:
+                current.peak_mb = (_max_rss() - current._base) / 1024**2
+            totals = _totals.setdefault(name, Totals())
+            totals.calls += 1
+            totals.errors += current.error is not None
+            totals.wall_seconds += current.wall_seconds
+            totals.cpu_seconds += current.cpu_seconds
+            totals.peak_mb = max(totals.peak_mb, current.peak_mb)
+            totals.pages += current.pages
+            totals.tokens += current.tokens
+        if (run := _run.get()) is not None:
+            run.add(current)
+
+
+def instrument(name: Optional[str] = None) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator form of `span`, named after the function by default."""
+
+    def decorate(func: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def record(pages: int = 0, tokens: int = 0) -> None:
+    """Count pages toward the innermost open span, and tokens toward it and
+    every span enclosing it."""
+    current = _span.get()
+    if current is None:
+        return
+    with _lock:
+        current.pages += pages
+        while current is not None:
+            current.tokens += tokens
+            current = current._outer
+
+
+def prometheus_text() -> str:
+    """Process-wide totals per span, in the Prometheus text exposition format."""
+    metrics = [
+        ("calls_total", "counter", "Instrumented calls.", "calls"),
+        ("errors_total", "counter", "Instrumented calls that raised.", "errors"),
+        ("wall_seconds_total", "counter", "Wall time spent in the span.", "wall_seconds"),
+        ("cpu_seconds_total", "counter", "CPU time of the calling thread.", "cpu_seconds"),
+        ("peak_megabytes", "gauge", "Largest peak memory of a single call.", "peak_mb"),
+        ("pages_total", "counter", "Pages processed.", "pages"),
+        ("tokens_total", "counter", "LLM tokens used.", "tokens"),
+    ]
+    with _lock:
+        totals = {name: asdict(t) for name, t in sorted(_totals.items())}
+
+    lines = []
+    for suffix, kind, help_text, key in metrics:
+        metric = f"pdf_span_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{span="{name}"}} {t[key]:g}' for name, t in totals.items()]
+    return "\n".join(lines) + "\n"
+
+
+def finish_run() -> None:
+    if TEXTFILE:
+        # Write then rename, so a scrape never sees a half-written file
+        with open(TEXTFILE + ".tmp", "w") as f:
+            f.write(prometheus_text())
+        os.replace(TEXTFILE + ".tmp", TEXTFILE)
+
+
+def show_run(run: Run) -> None:
+    """Per-stage breakdown of `run` with JSON and Prometheus downloads."""
+    with st.expander("Performance"):
+        df = run.to_dataframe()
+        if df.empty:
+            st.caption("Nothing was instrumented in this run.")
+            return
+        summary = df.groupby("name", sort=False).agg(
+            calls=("name", "size"),
+            wall_seconds=("wall_seconds", "sum"),
+            cpu_seconds=("cpu_seconds", "sum"),
+            peak_mb=("peak_mb", "max"),
+            pages=("pages", "sum"),
+            tokens=("tokens", "sum"),
+        )
+        st.dataframe(summary.sort_values("wall_seconds", ascending=False))
+        st.caption(
+            "Peak memory is traced allocations"
+            if TRACE_MEMORY
+            else "Peak memory is growth of the process's peak RSS; "
+            "set METRICS_TRACE_MEMORY=1 to trace allocations"
+        )
+        st.dataframe(df, hide_index=True)
+        col0, col1 = st.columns(2)
+        col0.download_button(
+            "Download run (JSON)", run.to_json(), "metrics.json", "application/json"
+        )
+        col1.download_button(
+            "Download totals (Prometheus)", prometheus_text(), "metrics.prom", "text/plain"
+        )
@@ -0,0 +1,66 @@
+from typing import List, Literal, Optional, Sequence, Tuple
+
+from utils.workers import (
+    PdfSource,
+    default_workers,
+    open_fitz,
+    open_source,
+    process_pool,
+    split_ranges,
+)
+
+Engine = Literal["pypdf", "pymupdf"]
+
+# Per-process document, opened once by the pool initializer
+_document = None
+
+
+def _open(pdf: PdfSource, engine: Engine, password: Optional[str]):
+    global _document
+    if engine == "pymupdf":
+        _document = open_fitz(pdf)
+        if _document.needs_pass:
+            _document.authenticate(password or "")
+    else:
+        from pypdf import PdfReader
+
+        _document = PdfReader(open_source(pdf))
+        if _document.is_encrypted:
+            _document.decrypt(password or "")
+
+
+def _extract_pages(
+    pages: Sequence[int], mode: Literal["plain", "layout"], engine: Engine
+) -> List[Tuple[int, str]]:
+    if engine == "pymupdf":
+        return [
+            (page + 1, _document[page].get_text("text", sort=mode == "layout"))
+            for page in pages
+        ]
+    return [
+        (page + 1, _document.pages[page].extract_text(extraction_mode=mode))
+        for page in pages
+    ]
+
+
+def extract_pages_parallel(
+    pdf: PdfSource,
+    pages: Sequence[int],
+    mode: Literal["plain", "layout"] = "plain",
+    workers: Optional[int] = None,
+    engine: Engine = "pypdf",
+    password: Optional[str] = None,
+    chunks_per_worker: int = 4,
+) -> List[Tuple[int, str]]:
+    """Extract the text of 0-based `pages` across worker processes.
+
+    Each worker opens the PDF once; pages are handed out in contiguous
+    ranges and the `(page_number, text)` results come back in input order.
+    """
+    if not pages:
+        return []
+    workers = workers or default_workers()
+    with process_pool(workers, _open, (pdf, engine, password)) as pool:
+        ranges = split_ranges(list(pages), workers * chunks_per_worker)
+        results = pool.map(_extract_pages, ranges, [mode] * len(ranges), [engine] * len(ranges))
+        return [item for run in results for item in run]
@@ -0,0 +1,289 @@
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import pandas as pd
+
+from utils import llm
+from utils.document import PdfDocument
+from utils.metrics import instrument, record, span
+from utils.regex_extraction import PageTextIndex, match_terms, terms_to_extract
+from utils.revisions import ExtractionStore, get_default_store, page_hashes
+
+# Regex answers below this confidence are re-checked by the LLM
+MIN_CONFIDENCE = 0.6
+
+
+@dataclass
+class TermResult:
+    term: str
+    value: str = ""
+    page: Union[int, str] = ""
+    source: str = "none"  # "regex", "fallback", "llm" or "none"
+    confidence: Optional[float] = 0.0  # Regex confidence; None for LLM answers
+    recomputed: bool = True  # False when carried over from an earlier revision
+
+
+@dataclass
+class HybridStats:
+    usage: llm.UsageStats = field(default_factory=llm.UsageStats)
+    regex_terms: int = 0
+    llm_terms: int = 0
+    pages_total: int = 0
+    pages_sent: int = 0
+    revision_of: Optional[str] = None  # Digest of the earlier revision reused
+    pages_changed: Optional[int] = None
+
+    @property
+    def pages_avoided(self) -> int:
+        return self.pages_total - self.pages_sent
+
+
+def _match_regex(
+    index: PageTextIndex,
+    terms: Sequence[str],
+    patterns: Dict[str, dict],
+    min_confidence: float,
+) -> Tuple[Dict[str, TermResult], List[str], Dict[str, tuple]]:
+    """Regex answers by term, the terms left for the LLM, and each term's pattern."""
+    configs = {name.lower(): (name, config) for name, config in patterns.items()}
+    term_patterns = {
+        term: configs[term.lower()] for term in terms if term.lower() in configs
+    }
+    matches = match_terms(index, dict(term_patterns.values()))
+
+    results: Dict[str, TermResult] = {}
+    unresolved: List[str] = []
+    for term in terms:
+        if term in term_patterns:
+            name, _ = term_patterns[term]
+            match = matches[name]
+            if match.source != "none" and match.confidence >= min_confidence:
+                results[term] = TermResult(
+                    term, match.value, match.page, "regex", match.confidence
+                )
+                continue
+            if match.source != "none":
+                # Keep the low-confidence answer in case the LLM finds nothing
+                results[term] = TermResult(
+                    term, match.value, match.page, "fallback", match.confidence
+                )
+        unresolved.append(term)
+    return results, unresolved, term_patterns
+
+
+def _candidate_pages(
+    index: PageTextIndex, terms: Sequence[str], term_patterns: Dict[str, tuple]
+) -> Set[int]:
+    """Pages the hints of `terms` point to; every page once a term has none."""
+    candidate_pages: Set[int] = set()
+    for term in terms:
+        hint = term_patterns.get(term, (None, {}))[1].get("page_hint")
+        if not hint or not (pages := index.candidate_pages(hint)):
+            return set(range(1, len(index) + 1))
+        candidate_pages.update(pages)
+    return candidate_pages
+
+
+@instrument()
+def extract_hybrid(
+    document: PdfDocument,
+    terms: Sequence[str],
+    patterns: Dict[str, dict] = terms_to_extract,
+    min_confidence: float = MIN_CONFIDENCE,
+    stats: Optional[HybridStats] = None,
+    **llm_kwargs,
+) -> List[TermResult]:
+    """Answer `terms` with the regex engine, and only the rest with the LLM.
+
+    Terms are matched to `patterns` case-insensitively. Terms without a
+    pattern, or whose regex answer falls below `min_confidence`, are sent to
+    the LLM restricted to the pages their hints point to.
+    """
+    stats = stats if stats is not None else HybridStats()
+    index = document.page_index
+    stats.pages_total = len(index)
+
+    results, unresolved, term_patterns = _match_regex(index, terms, patterns, min_confidence)
+    stats.regex_terms = len(terms) - len(unresolved)
+    stats.llm_terms = len(unresolved)
+
+    if unresolved:
+        candidate_pages = _candidate_pages(index, unresolved, term_patterns)
+        stats.pages_sent = len(candidate_pages)
+
+        # The page index has the text already; the LLM gets the same text
+        for term, value, page in llm.extract_relevant_information(
+            index.pages,
+            unresolved,
+            stats=stats.usage,
+            pages=candidate_pages,
+            **llm_kwargs,
+        ):
+            if value:
+                results[term] = TermResult(term, value, page, "llm", None)
+
+    return [results.get(term, TermResult(term)) for term in terms]
+
+
+def _carried(prior: dict, page_numbers: Dict[str, int]) -> Optional[TermResult]:
+    """An earlier result renumbered for this revision, unless its page changed."""
+    page = prior["page"]
+    if prior["anchor"] is not None:
+        if prior["anchor"] not in page_numbers:
+            return None
+        page = page_numbers[prior["anchor"]]
+    fields = {k: v for k, v in prior.items() if k not in ("anchor", "recomputed", "searched")}
+    return TermResult(**(fields | {"page": page, "recomputed": False}))
+
+
+@instrument()
+def extract_incremental(
+    document: PdfDocument,
+    terms: Sequence[str],
+    patterns: Dict[str, dict] = terms_to_extract,
+    min_confidence: float = MIN_CONFIDENCE,
+    stats: Optional[HybridStats] = None,
+    store: Optional[ExtractionStore] = None,
+    **llm_kwargs,
+) -> List[TermResult]:
+    """`extract_hybrid`, redoing only what changed since an earlier revision.
+
+    The earlier revision is the stored document sharing the most page hashes
+    with this one. Only pages it does not have are extracted. The LLM is
+    asked about changed pages alone: an earlier answer anchored on an
+    unchanged page stands unless a changed page answers the term, while one
+    whose page changed or is gone is searched for again. Results that were
+    not looked up again come back with `recomputed=False`.
+
+    The state is only stored after a complete run: not once `cancel` is set
+    or an LLM request failed, as the terms left empty are not known absent.
+    """
+    stats = stats if stats is not None else HybridStats()
+    store = store or get_default_store()
+    hashes = page_hashes(document.fitz)
+    previous = store.get(document.digest) or store.find_previous(hashes)
+
+    # Pages the earlier revision has are not extracted again
+    texts = store.texts(previous.digest, hashes) if previous is not None else {}
+    with span("index_pages"):
+        extracted = 0
+        for page_num, page in enumerate(hashes):
+            if page not in texts:
+                texts[page] = document.fitz[page_num].get_text("text")
+                extracted += 1
+        record(pages=extracted)
+    index = PageTextIndex(texts[page] for page in hashes)
+    stats.pages_total = len(index)
+
+    page_numbers: Dict[str, int] = {}
+    for page_num, page in enumerate(hashes, start=1):
+        page_numbers.setdefault(page, page_num)
+    priors: Dict[str, dict] = {}
+    changed = set(range(1, len(hashes) + 1))
+    if previous is not None:
+        if previous.digest != document.digest:
+            stats.revision_of = previous.digest
+        priors = {prior["term"]: prior for prior in previous.results}
+        seen = set(previous.page_hashes)
+        changed = {page_num for page_num, page in enumerate(hashes, start=1) if page not in seen}
+        stats.pages_changed = len(changed)
+
+    results, unresolved, term_patterns = _match_regex(index, terms, patterns, min_confidence)
+    stats.regex_terms = len(terms) - len(unresolved)
+    stats.llm_terms = len(unresolved)
+    for term, result in results.items():
+        # Regex matching is redone in full, as it is cheap once the text is known
+        carried = _carried(priors[term], page_numbers) if term in priors else None
+        result.recomputed = carried is None or (
+            (carried.value, carried.page, carried.source)
+            != (result.value, result.page, result.source)
+        )
+
+    # Terms the LLM searched the unchanged pages for already, and those it has not
+    carried_llm: Dict[str, TermResult] = {}
+    changed_only, everywhere = [], []
+    for term in unresolved:
+        prior = priors.get(term)
+        if (
+            previous is None
+            or prior is None
+            or not prior.get("searched")
+            or previous.model != llm.MODEL
+        ):
+            everywhere.append(term)
+        elif prior["source"] != "llm":
+            changed_only.append(term)
+        elif carried := _carried(prior, page_numbers):
+            carried_llm[term] = carried
+            changed_only.append(term)
+        else:
+            everywhere.append(term)
+
+    sent: Set[int] = set()
+    errors = len(stats.usage.errors)
+    for group, restrict in ((changed_only, True), (everywhere, False)):
+        if not group:
+            continue
+        pages = _candidate_pages(index, group, term_patterns)
+        if restrict:
+            pages &= changed
+        if not pages:
+            continue
+        sent |= pages
+        for term, value, page in llm.extract_relevant_information(
+            index.pages, group, stats=stats.usage, pages=pages, **llm_kwargs
+        ):
+            if value:
+                results[term] = TermResult(term, value, page, "llm", None)
+                carried_llm.pop(term, None)
+    stats.pages_sent = len(sent)
+    results |= carried_llm
+
+    found = [results.get(term, TermResult(term)) for term in terms]
+    for result in found:
+        if result.source == "none":
+            result.recomputed = priors.get(result.term, {}).get("source") != "none"
+
+    cancel = llm_kwargs.get("cancel")
+    if len(stats.usage.errors) > errors or (cancel is not None and cancel.is_set()):
+        return found
+    store.save(
+        document.digest,
+        hashes,
+        [
+            asdict(result)
+            | {
+                "anchor": hashes[result.page - 1]
+                if isinstance(result.page, int) and 0 < result.page <= len(hashes)
+                else None,
+                # The LLM looked for it everywhere it could be
+                "searched": result.term in unresolved,
+            }
+            for result in found
+        ],
+        llm.MODEL,
+        # The text of encrypted documents is not written to disk
+        {} if document.fitz.metadata.get("encryption") else texts,
+    )
+    return found
+
+
+def to_dataframe(results: Sequence[TermResult]) -> pd.DataFrame:
+    return pd.DataFrame(
+        [[r.term, r.value, r.page, r.source, r.confidence, r.recomputed] for r in results],
+        columns=["Term", "Response", "Page Number", "Source", "Confidence", "Recomputed"],
+    )
+
+
+def to_json(results: Sequence[TermResult], stats: HybridStats) -> bytes:
+    return json.dumps(
+        {"results": [asdict(r) for r in results], "stats": asdict(stats)}
+    ).encode()
+
+
+def from_json(data: bytes) -> Tuple[List[TermResult], HybridStats]:
+    payload = json.loads(data)
+    stats = payload["stats"]
+    stats["usage"] = llm.UsageStats(**stats["usage"])
+    return [TermResult(**r) for r in payload["results"]], HybridStats(**stats)
@@ -0,0 +1,49 @@
+import fitz  # PyMuPDF
+import streamlit as st
+
+from utils.document import BytesCache
+from utils.metrics import record, span
+
+PREVIEW_SCALES = {"Small": 0.4, "Medium": 0.7, "Large": 1.0}
+PAGES_PER_VIEW = 3
+
+# Rendered PNGs keyed by (document hash, page, scale)
+thumbnails = BytesCache(max_bytes=64 * 1024**2)
+
+
+def render_thumbnail(
+    doc: fitz.Document, doc_hash: str, page_num: int, scale: float = 0.4
+) -> bytes:
+    key = (doc_hash, page_num, scale)
+    if (png := thumbnails.get(key)) is None:
+        pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(scale, scale))
+        png = pix.tobytes("png")
+        thumbnails.put(key, png)
+        record(pages=1)
+    return png
+
+
+def show_preview(doc: fitz.Document, doc_hash: str, key: str = "preview") -> None:
+    """Paginated preview that only renders the pages currently in view."""
+    page_count = doc.page_count
+    col0, col1 = st.columns(2)
+    size = col0.selectbox("Size", list(PREVIEW_SCALES), key=f"{key}_scale")
+    start = col1.number_input(
+        "From page",
+        min_value=1,
+        max_value=page_count,
+        value=1,
+        step=PAGES_PER_VIEW,
+        key=f"{key}_start",
+    )
+
+    end = min(start - 1 + PAGES_PER_VIEW, page_count)
+    # Pages counts only the thumbnails rendered rather than served from cache
+    with span("preview"):
+        for page_num in range(start - 1, end):
+            st.image(
+                render_thumbnail(doc, doc_hash, page_num, PREVIEW_SCALES[size]),
+                caption=f"Page {page_num + 1}",
+                use_container_width=True,
+            )
+    st.caption(f"Pages {start}-{end} of {page_count}")
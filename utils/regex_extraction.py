@@ -0,0 +1,260 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Set, Union
+
+import fitz  # PyMuPDF
+
+# Define extraction configuration
+terms_to_extract = {
+    "Plan Name": {"pattern": r"Plan name:\s*(.*?)\n", "page_hint": "Plan Name/Effective Date"},
+    "Trustee": {"pattern": r"Trustee:\s*(.*?)\n", "fallback": "Not explicitly mentioned"},
+    "EIN": {"pattern": r"EIN:\s*(\d{2}-\d{7})", "page_hint": "EMPLOYER INFORMATION"},
+    "Year End": {"pattern": r"fiscal year end:\s*(\d{2}/\d{2})", "page_hint": "Plan Year"},
+    "Entity Type": {"pattern": r"entity type:\s*(.*?)\n", "page_hint": "EMPLOYER INFORMATION"},
+    "Entity State": {"pattern": r"state:\s*([A-Z]{2})", "page_hint": "EMPLOYER INFORMATION"},
+    "Is it a Safe Harbor": {
+        "pattern": r"Safe harbor contributions are permitted.*?\n.*?\n\s*(Yes|No)",
+        "fallback": "No",
+    },
+    "Vesting": {"pattern": r"Vesting Schedule.*?\n.*?\n\s*(.*?)\n", "page_hint": "VESTING"},
+    "Profit Sharing Vesting": {
+        "pattern": r"Non-Elective Contributions.*?Vesting Schedule.*?\n.*?\n\s*(.*?)\n",
+        "page_hint": "VESTING",
+    },
+    "Elapsed Vesting": {"pattern": r"Elapsed Vesting.*?\s(True|False)", "fallback": "False"},
+    "Plan Type": {"pattern": r"Plan Type.*?\s*(401\(k\))", "page_hint": "PLAN INFORMATION"},
+    "Compensation Definition": {
+        "pattern": r"Definition of Statutory Compensation.*?\s*(W-2 Compensation|Withholding|Section 415)",
+        "page_hint": "Compensation",
+    },
+    "Deferral Change Frequency": {
+        "pattern": r"Participants modify/start/stop Elective Deferrals.*?\n.*?\n\s*(.*?)\n",
+        "page_hint": "CONTRIBUTIONS",
+    },
+    "Match Frequency": {
+        "pattern": r"determining the amount of an allocation.*?\n.*?\n\s*(.*?)\n",
+        "page_hint": "CONTRIBUTIONS",
+    },
+    "Entry Date": {
+        "pattern": r"Entry Dates for Plan Participation.*?\n.*?\n\s*(.*?)\n",
+        "page_hint": "Eligibility",
+    },
+    "Match Entry Date": {"pattern": r"Match Entry date.*?\n.*?\n\s*(.*?)\n", "page_hint": "Eligibility"},
+    "Profit Share Entry Date": {
+        "pattern": r"Profit share entry date.*?\n.*?\n\s*(.*?)\n",
+        "page_hint": "Eligibility",
+    },
+    "Minimum Age": {"pattern": r"Age Requirement.*?\n.*?\n\s*(\d+)", "page_hint": "Eligibility"},
+    "Match Minimum Age": {"pattern": r"Match Minimum age.*?\n.*?\n\s*(\d+)", "page_hint": "Eligibility"},
+    "Profit Share Minimum Age": {
+        "pattern": r"Profit Share Minimum Age.*?\n.*?\n\s*(\d+)",
+        "page_hint": "Eligibility",
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# Lines treated as section headings: all caps, or numbered ("3.1 Eligibility", "Article IV ...")
+_NUMBERED_HEADING = re.compile(
+    r"^(?:section|article|part)?\s*(?:\d+(?:\.\d+)*|[IVXLC]+)[.)]?\s+[A-Za-z]", re.I
+)
+
+
+def _is_heading(line: str) -> bool:
+    return 3 < len(line) <= 80 and (
+        (line.isupper() and any(c.isalpha() for c in line))
+        or bool(_NUMBERED_HEADING.match(line))
+    )
+
+
+class PageTextIndex:
+    """Text of every page, extracted once and kept raw and lowercased.
+
+    Also serves as an inverted index from section headings and hint keywords
+    to the pages they point at, built lazily and shared by all terms.
+    """
+
+    def __init__(self, pages: Iterable[str]):
+        self.pages: List[str] = list(pages)
+        self.lower_pages: List[str] = [text.lower() for text in self.pages]
+        self._headings: Optional[Dict[str, List[int]]] = None
+        self._hint_pages: Dict[str, List[int]] = {}
+        self._candidates: Dict[str, List[int]] = {}
+
+    @classmethod
+    def from_document(cls, doc: fitz.Document) -> "PageTextIndex":
+        return cls(page.get_text("text") for page in doc)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    @property
+    def headings(self) -> Dict[str, List[int]]:
+        """Lowercased section heading -> pages it appears on."""
+        if self._headings is None:
+            self._headings = {}
+            for page_num, text in enumerate(self.pages, start=1):
+                for line in text.splitlines():
+                    line = line.strip()
+                    if _is_heading(line):
+                        pages = self._headings.setdefault(line.lower(), [])
+                        if not pages or pages[-1] != page_num:
+                            pages.append(page_num)
+        return self._headings
+
+    def hint_pages(self, hints: Iterable[str]) -> Dict[str, List[int]]:
+        """Map each hint to the (1-based) pages containing it, case-insensitively."""
+        hints = {hint.lower() for hint in hints if hint}
+        missing = hints - self._hint_pages.keys()
+        if missing:
+            self._hint_pages.update(self._scan_hints(missing))
+        return {hint: self._hint_pages[hint] for hint in hints}
+
+    def _scan_hints(self, hints: Set[str]) -> Dict[str, List[int]]:
+        found: Dict[str, List[int]] = {hint: [] for hint in hints}
+
+        # Hints nested inside another hint can hide behind it in the combined
+        # pass, so those are checked on their own
+        nested = {h for h in hints if any(h != other and h in other for other in hints)}
+        combined = re.compile(
+            "(?=(%s))"
+            % "|".join(map(re.escape, sorted(hints - nested, key=len, reverse=True)))
+        )
+
+        for page_num, text in enumerate(self.lower_pages, start=1):
+            on_page: Set[str] = {m.group(1) for m in combined.finditer(text)}
+            on_page.update(hint for hint in nested if hint in text)
+            for hint in on_page:
+                found[hint].append(page_num)
+        return found
+
+    def candidate_pages(self, hint: str) -> List[int]:
+        """Pages to search first for a term hinted at `hint`.
+
+        Pages whose headings contain the hint come first, each followed by the
+        next page since sections run on, then any other page mentioning it.
+        """
+        key = hint.lower()
+        if key not in self._candidates:
+            pages: Dict[int, None] = {}
+            for heading, heading_pages in self.headings.items():
+                if key in heading:
+                    for page_num in heading_pages:
+                        pages[page_num] = None
+                        if page_num < len(self.pages):
+                            pages[page_num + 1] = None
+            pages.update(dict.fromkeys(self.hint_pages([key])[key]))
+            self._candidates[key] = list(pages)
+        return self._candidates[key]
+
+
+_index_cache: "OrderedDict[str, PageTextIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+INDEX_CACHE_SIZE = 8
+
+
+def get_index(pdf: bytes) -> PageTextIndex:
+    """Page index for a PDF, cached by content hash across calls."""
+    digest = hashlib.blake2b(pdf, digest_size=16).hexdigest()
+    with _index_lock:
+        if digest in _index_cache:
+            _index_cache.move_to_end(digest)
+            return _index_cache[digest]
+
+    index = PageTextIndex.from_document(fitz.open(stream=pdf, filetype="pdf"))
+    with _index_lock:
+        _index_cache[digest] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+class TermMatch(NamedTuple):
+    value: str
+    page: Union[int, str]
+    source: str  # "pattern", "fallback" or "none"
+    confidence: float
+
+
+# How much to trust a regex answer, by how it was found
+CONFIDENCE = {
+    "hinted page": 0.9,  # Pattern matched on a page its hint points to
+    "unhinted": 0.8,  # Pattern matched, and the term has no hint
+    "off hint": 0.6,  # Pattern matched away from the hinted pages
+    "hinted fallback": 0.4,
+    "fallback": 0.2,
+}
+
+
+def match_terms(index: PageTextIndex, patterns) -> Dict[str, TermMatch]:
+    compiled = {
+        term: compile_pattern(config["pattern"])
+        for term, config in patterns.items()
+        if config.get("pattern")
+    }
+    hint_pages = index.hint_pages(
+        config["page_hint"] for config in patterns.values() if config.get("page_hint")
+    )
+
+    # Try the pages each term's hint points to first
+    matches: Dict[str, TermMatch] = {}
+    searched: Dict[str, Set[int]] = {}
+    for term, regex in compiled.items():
+        if not (page_hint := patterns[term].get("page_hint")):
+            continue
+        searched[term] = set()
+        for page_num in index.candidate_pages(page_hint):
+            searched[term].add(page_num)
+            if match := regex.search(index.pages[page_num - 1]):
+                matches[term] = TermMatch(
+                    match.group(1).strip(), page_num, "pattern", CONFIDENCE["hinted page"]
+                )
+                break
+
+    # Then a single pass over the remaining pages for everything still missing
+    remaining = {term: regex for term, regex in compiled.items() if term not in matches}
+    for page_num, page_text in enumerate(index.pages, start=1):
+        if not remaining:
+            break
+        for term, regex in list(remaining.items()):
+            if page_num in searched.get(term, ()):
+                continue
+            if match := regex.search(page_text):
+                confidence = CONFIDENCE["off hint" if term in searched else "unhinted"]
+                matches[term] = TermMatch(
+                    match.group(1).strip(), page_num, "pattern", confidence
+                )
+                del remaining[term]
+
+    results = {}
+    for term, config in patterns.items():
+        fallback = config.get("fallback", None)
+        page_hint: Optional[str] = config.get("page_hint", None)
+
+        if term in matches:
+            results[term] = matches[term]
+        elif fallback:
+            # Fall back on the last page mentioning the hint, if any
+            if page_hint and (pages := hint_pages[page_hint.lower()]):
+                results[term] = TermMatch(
+                    fallback, pages[-1], "fallback", CONFIDENCE["hinted fallback"]
+                )
+            else:
+                results[term] = TermMatch(fallback, "N/A", "fallback", CONFIDENCE["fallback"])
+        else:
+            results[term] = TermMatch("Not Found", "N/A", "none", 0.0)
+    return results
+
+
+def extract_terms_from_text(doc, patterns):
+    index = doc if isinstance(doc, PageTextIndex) else PageTextIndex.from_document(doc)
+    return [
+        [term, match.value, match.page] for term, match in match_terms(index, patterns).items()
+    ]
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+
+import fitz  # PyMuPDF
+
+DEFAULT_PATH = Path(
+    os.getenv(
+        "EXTRACTION_STATE_PATH", Path.home() / ".cache" / "pdf-workdesk" / "extractions.sqlite"
+    )
+)
+# A stored document is taken for an earlier revision when it has at least
+# this share of the new document's pages
+MIN_SHARED_PAGES = 0.5
+
+
+def page_hash(page: fitz.Page) -> str:
+    """Hash of what a page's text is drawn from, several times cheaper than the text.
+
+    That is the page's content stream, those of the Form XObjects it draws
+    (nested ones included), and the fonts of all of them with their
+    ToUnicode maps. Streams are compared decompressed, and objects by name
+    rather than by xref, so re-saving a file does not change the hashes of
+    its pages.
+    """
+    doc = page.parent
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(page.read_contents())
+    for xref, name, _, bbox in page.get_xobjects():
+        digest.update(repr((name, tuple(bbox))).encode())
+        digest.update(doc.xref_stream(xref) or b"")
+    for font in page.get_fonts(full=True):
+        digest.update(repr(font[1:6]).encode())
+        kind, ref = doc.xref_get_key(font[0], "ToUnicode")
+        if kind == "xref":
+            digest.update(doc.xref_stream(int(ref.split()[0])) or b"")
+    digest.update(repr((tuple(page.rect), page.rotation)).encode())
+    return digest.hexdigest()
+
+
+def page_hashes(doc: fitz.Document) -> List[str]:
+    return [page_hash(page) for page in doc]
+
+
+class Revision(NamedTuple):
+    digest: str
+    page_hashes: List[str]
+    # `TermResult` fields, plus "anchor": the hash of the page the answer came from
+    results: List[dict]
+    model: str
+
+
+class ExtractionStore:
+    """SQLite store of each document's page hashes, page text and extraction results.
+
+    Page text is only ever reused for a later revision of the same
+    document, never for another document that happens to share a page.
+    Documents older than `max_age` seconds are dropped with their text.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_PATH, max_age: float = 90 * 24 * 3600):
+        self.path = Path(path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                digest TEXT PRIMARY KEY,
+                page_hashes TEXT NOT NULL,
+                results TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS document_pages (
+                hash TEXT NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS document_pages_hash ON document_pages (hash);
+            CREATE INDEX IF NOT EXISTS document_pages_digest ON document_pages (digest);
+            CREATE TABLE IF NOT EXISTS document_texts (
+                digest TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (digest, hash)
+            );
+            CREATE TEMP TABLE probe (hash TEXT PRIMARY KEY);
+            """
+        )
+        self._conn.commit()
+        self.prune()
+
+    def get(self, digest: str) -> Optional[Revision]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, page_hashes, results, model FROM documents WHERE digest = ?",
+                (digest,),
+            ).fetchone()
+        return self._revision(row) if row else None
+
+    def find_previous(self, hashes: List[str]) -> Optional[Revision]:
+        """The stored document sharing the most pages with `hashes`, if enough do."""
+        if not hashes:
+            return None
+        with self._lock:
+            self._fill_probe(hashes)
+            row = self._conn.execute(
+                "SELECT d.digest, d.page_hashes, d.results, d.model, "
+                "COUNT(DISTINCT p.hash) AS shared FROM probe "
+                "JOIN document_pages p ON p.hash = probe.hash "
+                "JOIN documents d ON d.digest = p.digest "
+                "GROUP BY d.digest ORDER BY shared DESC, d.created DESC LIMIT 1"
+            ).fetchone()
+        if row is None or row[4] < MIN_SHARED_PAGES * len(set(hashes)):
+            return None
+        return self._revision(row[:4])
+
+    def texts(self, digest: str, hashes: Iterable[str]) -> Dict[str, str]:
+        """Stored text of whichever of these pages document `digest` has."""
+        with self._lock:
+            self._fill_probe(hashes)
+            return dict(
+                self._conn.execute(
+                    "SELECT t.hash, t.text FROM probe "
+                    "JOIN document_texts t ON t.hash = probe.hash AND t.digest = ?",
+                    (digest,),
+                )
+            )
+
+    def save(
+        self,
+        digest: str,
+        hashes: List[str],
+        results: List[dict],
+        model: str,
+        texts: Dict[str, str],
+    ) -> None:
+        with self._lock:
+            conn = self._conn
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                (digest, json.dumps(hashes), json.dumps(results), model, time.time()),
+            )
+            conn.execute("DELETE FROM document_pages WHERE digest = ?", (digest,))
+            conn.executemany(
+                "INSERT INTO document_pages VALUES (?, ?)",
+                [(page, digest) for page in set(hashes)],
+            )
+            conn.execute("DELETE FROM document_texts WHERE digest = ?", (digest,))
+            conn.executemany(
+                "INSERT INTO document_texts VALUES (?, ?, ?)",
+                [(digest, page, text) for page, text in texts.items()],
+            )
+            conn.commit()
+
+    def prune(self) -> None:
+        with self._lock:
+            conn = self._conn
+            old = conn.execute(
+                "SELECT digest FROM documents WHERE created < ?", (time.time() - self.max_age,)
+            ).fetchall()
+            conn.executemany("DELETE FROM documents WHERE digest = ?", old)
+            conn.executemany("DELETE FROM document_pages WHERE digest = ?", old)
+            conn.executemany("DELETE FROM document_texts WHERE digest = ?", old)
+            conn.commit()
+
+    def _fill_probe(self, hashes: Iterable[str]) -> None:
+        # Hashes are joined through a temp table; documents outgrow SQLite's
+        # limit on query parameters
+        self._conn.execute("DELETE FROM probe")
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO probe VALUES (?)", ((page,) for page in hashes)
+        )
+
+    @staticmethod
+    def _revision(row: tuple) -> Revision:
+        digest, hashes, results, model = row
+        return Revision(digest, json.loads(hashes), json.loads(results), model)
+
+
+_default_store: Optional[ExtractionStore] = None
+_default_lock = threading.Lock()
+
+
+def get_default_store() -> ExtractionStore:
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ExtractionStore()
+        return _default_store
@@ -0,0 +1,141 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBudget:
+    """Sliding one-minute window of token spend shared by all workers."""
+
+    def __init__(self, tokens_per_minute: int, window: float = 60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+    def _used(self, now: float) -> int:
+        while self._spent and now - self._spent[0][0] >= self.window:
+            self._spent.popleft()
+        return sum(tokens for _, tokens in self._spent)
+
+    def acquire(self, tokens: int, cancelled: Optional[threading.Event] = None) -> bool:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                used = self._used(now)
+                # A single request larger than the budget still goes out on an empty window
+                if used + tokens <= self.tokens_per_minute or not self._spent:
+                    self._spent.append((now, tokens))
+                    return True
+                wait_for = self.window - (now - self._spent[0][0])
+            if cancelled is None:
+                time.sleep(min(wait_for, 1.0))
+            elif cancelled.wait(min(wait_for, 1.0)):
+                return False
+
+
+class RequestScheduler:
+    """Runs requests on a thread pool under a concurrency limit and token budget.
+
+    Jobs are dispatched lazily, so each request is built from the state left by
+    the requests that finished before it. Failures listed in `retry_on` are
+    retried with exponential backoff; once `is_done` returns True no further
+    jobs are dispatched and queued ones are cancelled.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        tokens_per_minute: Optional[int] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.budget = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+        self.retry_on = retry_on
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _call(
+        self,
+        fn: Callable[[T], R],
+        job: T,
+        cost: Optional[Callable[[T], int]],
+        cancelled: threading.Event,
+    ) -> Optional[R]:
+        for attempt in range(self.max_retries + 1):
+            if cancelled.is_set():
+                return None
+            if self.budget is not None and cost is not None:
+                if not self.budget.acquire(cost(job), cancelled):
+                    return None
+            try:
+                return fn(job)
+            except self.retry_on:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                if cancelled.wait(delay * (0.5 + random.random() / 2)):
+                    return None
+
+    def run(
+        self,
+        jobs: Iterable[T],
+        fn: Callable[[T], R],
+        cost: Optional[Callable[[T], int]] = None,
+        is_done: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[Tuple[T, Optional[R], Optional[BaseException]]]:
+        """Yield `(job, result, error)` in completion order."""
+        jobs = iter(jobs)
+        cancelled = threading.Event()
+        in_flight: Dict[Future, T] = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+        def done() -> bool:
+            return is_done is not None and is_done()
+
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and not done() and len(in_flight) < self.max_concurrency:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    # Run in a copy of the caller's context so its metrics span applies
+                    context = contextvars.copy_context()
+                    in_flight[
+                        executor.submit(context.run, self._call, fn, job, cost, cancelled)
+                    ] = job
+
+                if not in_flight or done():
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = in_flight.pop(future)
+                    error = future.exception()
+                    yield job, None if error else future.result(), error
+        finally:
+            # Requests already on the wire are left to finish; their results are dropped
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
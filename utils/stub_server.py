@@ -0,0 +1,131 @@
+"""Local stand-in for the OpenAI completions endpoint.
+
+Answers each requested term whose name appears in the prompt text as
+`<term>: <value>`, reporting the page from the nearest `[Page N]` marker.
+
+    python -m utils.stub_server --port 8765 --rate-limit-every 5
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run app.py
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+
+def _requested_terms(prompt: str) -> List[str]:
+    section = prompt.split("response options in parentheses:", 1)[-1]
+    terms = []
+    for line in section.splitlines()[1:]:
+        line = line.strip()
+        if not line:
+            break
+        terms.append(re.sub(r"\s*\(.*\)$", "", line))
+    return terms
+
+
+def answer(prompt: str) -> str:
+    rows = ["Term | Response | Page number"]
+    for term in _requested_terms(prompt):
+        value, page = "", ""
+        for match in re.finditer(rf"{re.escape(term)}\s*:\s*([^\n]+)", prompt, re.I):
+            pages = re.findall(r"\[Page (\d+)\]", prompt[: match.start()])
+            if pages:
+                value, page = match.group(1).strip(), pages[-1]
+                break
+        rows.append(f"{term} | {value} | {page}")
+    return "\n".join(rows)
+
+
+class StubCompletionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+        latency: float = 0.0,
+        rate_limit_every: int = 0,
+    ):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubCompletionServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StubCompletionServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server._lock:
+            self.server.requests += 1
+            count = self.server.requests
+
+        every = self.server.rate_limit_every
+        if every and count % every == 0:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+            return
+
+        time.sleep(self.server.latency)
+        prompt = body.get("prompt", "")
+        text = answer(prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(text) // 4
+        self._send(
+            200,
+            {
+                "id": f"cmpl-stub-{count}",
+                "object": "text_completion",
+                "model": body.get("model"),
+                "choices": [{"text": text, "index": 0, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubCompletionServer(
+        (args.host, args.port), args.latency, args.rate_limit_every
+    )
+    print(f"Serving stub completions on {server.api_base}")
+    server.serve_forever()
@@ -0,0 +1,141 @@
+from io import BytesIO
+from typing import Iterable, Iterator, List, Literal, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from utils.document import LruCache, PdfDocument
+from utils.workers import (
+    PdfSource,
+    default_workers,
+    open_source,
+    process_pool,
+    split_ranges,
+)
+
+Strategy = Literal["lines", "lines_strict", "text"]
+Table = List[List[Optional[str]]]
+
+# Documents with at least this many selected pages are split across processes
+PARALLEL_MIN_PAGES = 40
+
+# Raw tables per (document hash, page, strategies), shared across reruns
+table_cache = LruCache(max_items=5000)
+
+# Per-process pdfplumber document, opened once by the pool initializer
+_pdf = None
+
+
+def _open(pdf: PdfSource, password: str) -> None:
+    global _pdf
+    import pdfplumber
+
+    _pdf = pdfplumber.open(open_source(pdf), password=password)
+
+
+def _extract_page(page, vertical: Strategy, horizontal: Strategy) -> List[Table]:
+    tables = page.extract_tables(
+        {"vertical_strategy": vertical, "horizontal_strategy": horizontal}
+    )
+    page.flush_cache()
+    return tables
+
+
+def _extract_range(
+    pages: Sequence[int], vertical: Strategy, horizontal: Strategy
+) -> List[Tuple[int, List[Table]]]:
+    return [(page, _extract_page(_pdf.pages[page], vertical, horizontal)) for page in pages]
+
+
+def _to_dataframe(table: Table, header: bool) -> pd.DataFrame:
+    return pd.DataFrame(table[1 if header else 0 :], columns=table[0] if header else None)
+
+
+def _extract_parallel(
+    document: PdfDocument,
+    pages: List[int],
+    vertical: Strategy,
+    horizontal: Strategy,
+    workers: Optional[int],
+) -> Iterator[Tuple[int, List[Table]]]:
+    workers = workers or default_workers()
+    ranges = split_ranges(pages, 4 * workers)
+    pool = process_pool(workers, _open, (document.source, document.password))
+    try:
+        for results in pool.map(
+            _extract_range, ranges, [vertical] * len(ranges), [horizontal] * len(ranges)
+        ):
+            yield from results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_tables(
+    document: PdfDocument,
+    pages: Sequence[int],
+    vertical: Strategy = "text",
+    horizontal: Strategy = "text",
+    header: bool = False,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, int, pd.DataFrame]]:
+    """Yield `(page_number, table_index, DataFrame)` for 0-based `pages`, in page order.
+
+    Tables are cached per page and strategy pair, so changing only `header`
+    or revisiting pages costs nothing. Large uncached selections are split
+    across worker processes, with results still streamed in order.
+    """
+    known = {
+        page: table_cache.get((document.digest, page, vertical, horizontal))
+        for page in pages
+    }
+    missing = [page for page in pages if known[page] is None]
+
+    if len(missing) >= PARALLEL_MIN_PAGES and workers != 1:
+        computed = _extract_parallel(document, missing, vertical, horizontal, workers)
+    else:
+        computed = (
+            (page, _extract_page(document.plumber.pages[page], vertical, horizontal))
+            for page in missing
+        )
+
+    for page in pages:
+        if (tables := known[page]) is None:
+            _, tables = next(computed)
+            table_cache.put((document.digest, page, vertical, horizontal), tables)
+        for i, table in enumerate(tables):
+            yield page + 1, i, _to_dataframe(table, header)
+
+
+def _column_names(columns) -> List[str]:
+    names: List[str] = []
+    for j, column in enumerate(columns, start=1):
+        if column in (None, "") or isinstance(column, int):
+            name = f"column_{j}"
+        else:
+            name = str(column)
+        while name in names or name in ("page", "table", "row"):
+            name += "_"
+        names.append(name)
+    return names
+
+
+def export_tables(
+    tables: Iterable[Tuple[int, int, pd.DataFrame]], fmt: Literal["xlsx", "parquet"]
+) -> bytes:
+    """Write every table to one file: a sheet per table, or one long Parquet table."""
+    buffer = BytesIO()
+    if fmt == "xlsx":
+        with pd.ExcelWriter(buffer) as writer:
+            for page, i, df in tables:
+                df.to_excel(writer, sheet_name=f"Page {page} table {i + 1}", index=False)
+        return buffer.getvalue()
+
+    frames = []
+    for page, i, df in tables:
+        df = df.astype("string").set_axis(_column_names(df.columns), axis=1)
+        df.insert(0, "row", range(1, len(df) + 1))
+        df.insert(0, "table", i + 1)
+        df.insert(0, "page", page)
+        frames.append(df)
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    combined.to_parquet(buffer, index=False)
+    return buffer.getvalue()
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.document import BytesCache
+
+MAX_BYTES = 200 * 1024**2
+TIMEOUT: Tuple[float, float] = (5, 30)  # (connect, read) seconds
+# Cached downloads younger than this are reused without asking the server
+FRESH_SECONDS = 60
+# Total size of the downloaded bodies kept for reuse
+CACHE_BYTES = 256 * 1024**2
+
+
+class DownloadTooLarge(ValueError):
+    pass
+
+
+class Download(NamedTuple):
+    data: bytes
+    digest: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    checked_at: float = 0.0
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# One connection pool for every session and rerun
+session = _make_session()
+
+# Bodies by URL, and the validators to revalidate each (with empty data)
+bodies = BytesCache(max_bytes=CACHE_BYTES)
+_downloads: Dict[str, Download] = {}
+_lock = threading.Lock()
+
+
+def _read_body(response: requests.Response, max_bytes: int) -> Tuple[bytes, str]:
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise DownloadTooLarge(f"{int(length):,} bytes exceeds the {max_bytes:,} byte limit")
+
+    digest = hashlib.blake2b(digest_size=16)
+    body = bytearray()
+    for block in response.iter_content(64 * 1024):
+        if len(body) + len(block) > max_bytes:
+            raise DownloadTooLarge(f"Response exceeds the {max_bytes:,} byte limit")
+        digest.update(block)
+        body += block
+    return bytes(body), digest.hexdigest()
+
+
+def fetch_pdf(
+    url: str,
+    max_bytes: int = MAX_BYTES,
+    timeout: Tuple[float, float] = TIMEOUT,
+    fresh_seconds: float = FRESH_SECONDS,
+) -> Download:
+    """Download `url`, reusing the cached copy while the server says it is unchanged.
+
+    A copy younger than `fresh_seconds` is returned without a request. Older
+    copies are revalidated with If-None-Match / If-Modified-Since. Raises
+    `DownloadTooLarge` past `max_bytes` and `requests.RequestException` on
+    network or HTTP errors.
+    """
+    with _lock:
+        cached = _downloads.get(url)
+    if cached is not None:
+        data = bodies.get(url)
+        cached = cached._replace(data=data) if data is not None else None
+    if cached is not None and time.time() - cached.checked_at < fresh_seconds:
+        return cached
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304 and cached is not None:
+            download = cached._replace(checked_at=time.time())
+        else:
+            response.raise_for_status()
+            data, digest = _read_body(response, max_bytes)
+            download = Download(
+                data,
+                digest,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                time.time(),
+            )
+
+    bodies.put(url, download.data)
+    with _lock:
+        _downloads[url] = download._replace(data=b"")
+        # Validators are only worth keeping while the body they vouch for is
+        for dropped in [key for key in _downloads if key not in bodies]:
+            del _downloads[dropped]
+    return download
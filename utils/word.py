@@ -0,0 +1,129 @@
+import threading
+import time
+from io import BytesIO
+from typing import Callable, List, Optional, Sequence
+
+from pdf2docx import Converter
+
+from utils.document import LruCache
+from utils.workers import PdfSource, default_workers, process_pool
+
+# Pages parsed per job; each range reports progress and is cached when done
+PAGES_PER_RANGE = 8
+# Below this many pages to parse, converting in-process beats starting a pool
+PARALLEL_MIN_PAGES = 16
+
+Progress = Callable[[float, str], None]
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+# Parsed page layouts per (document hash, page), shared across reruns
+page_cache = LruCache(max_items=2000)
+
+# Source of a pool worker process, set once by the pool initializer. The
+# in-process path passes its own, as threads share these globals.
+_source: Optional[PdfSource] = None
+_password: str = ""
+
+
+def _open(pdf: PdfSource, password: str) -> None:
+    global _source, _password
+    _source, _password = pdf, password
+
+
+def _converter(pdf: PdfSource, password: str) -> Converter:
+    if isinstance(pdf, str):
+        return Converter(pdf, password=password or None)
+    return Converter(stream=pdf, password=password or None)
+
+
+def _parse_pages(pdf: PdfSource, password: str, pages: Sequence[int]) -> List[dict]:
+    """Parse 0-based `pages` into pdf2docx's serialised page layouts."""
+    cv = _converter(pdf, password)
+    try:
+        settings = cv.default_settings
+        cv.load_pages(pages=list(pages))
+        cv.parse_document(**settings).parse_pages(**settings)
+        # Converter.store() needs a file name, which a stream does not have
+        return [page.store() for page in cv.pages if page.finalized]
+    finally:
+        cv.close()
+
+
+def _parse_range(pages: Sequence[int]) -> List[dict]:
+    return _parse_pages(_source, _password, pages)
+
+
+def _ranges(pages: Sequence[int], size: int) -> List[List[int]]:
+    """Split sorted `pages` into contiguous runs of at most `size` pages."""
+    runs: List[List[int]] = []
+    for page in pages:
+        if runs and page == runs[-1][-1] + 1 and len(runs[-1]) < size:
+            runs[-1].append(page)
+        else:
+            runs.append([page])
+    return runs
+
+
+def convert_to_docx(
+    pdf: PdfSource,
+    digest: str,
+    password: str = "",
+    pages: Optional[Sequence[int]] = None,
+    workers: Optional[int] = None,
+    pages_per_range: int = PAGES_PER_RANGE,
+    progress: Optional[Progress] = None,
+    cancel: Optional[threading.Event] = None,
+) -> bytes:
+    """Convert 0-based `pages` (default all) of `pdf` to a DOCX.
+
+    Pages are parsed in ranges across worker processes and every parsed page
+    is cached under `digest`, so converting an overlapping selection later
+    only parses the new pages. The parsed layouts are then written to one
+    document in page order. Setting `cancel` stops at the next finished
+    range with `ConversionCancelled`; ranges finished so far stay cached.
+    """
+    progress = progress or (lambda fraction, text: None)
+    cv = _converter(pdf, password)
+    try:
+        page_count = len(cv.fitz_doc)
+        pages = sorted(set(range(page_count) if pages is None else pages))
+        parsed = {page: page_cache.get((digest, page)) for page in pages}
+        ranges = _ranges([p for p in pages if parsed[p] is None], pages_per_range)
+        todo = sum(map(len, ranges))
+
+        def finish(results: List[dict], done: int) -> None:
+            for page in results:
+                page_cache.put((digest, page["id"]), page)
+                parsed[page["id"]] = page
+            progress(0.9 * done / todo, f"Converted {done} of {todo} pages")
+            if cancel is not None and cancel.is_set():
+                raise ConversionCancelled(f"Cancelled after {done} of {todo} pages")
+
+        done = 0
+        if todo >= PARALLEL_MIN_PAGES and workers != 1:
+            workers = min(workers or default_workers(), len(ranges))
+            pool = process_pool(workers, _open, (pdf, password))
+            try:
+                for run, results in zip(ranges, pool.map(_parse_range, ranges)):
+                    done += len(run)
+                    finish(results, done)
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            for run in ranges:
+                done += len(run)
+                finish(_parse_pages(pdf, password, run), done)
+
+        progress(0.95, "Writing document")
+        start = time.perf_counter()
+        cv.restore({"page_cnt": page_count, "pages": [parsed[page] for page in pages]})
+        docx = BytesIO()
+        cv.make_docx(docx, **cv.default_settings)
+        progress(1.0, f"Done, document written in {time.perf_counter() - start:.1f}s")
+        return docx.getvalue()
+    finally:
+        cv.close()
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import BinaryIO, Callable, List, Optional, Sequence, TypeVar, Union
+
+T = TypeVar("T")
+
+# PDF bytes, or the path of a PDF spooled to disk. Workers given a path open
+# the file themselves instead of receiving a pickled copy of the bytes.
+PdfSource = Union[bytes, str]
+
+# Streamlit runs scripts on threads, which makes fork() unsafe; spawn instead
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def split_ranges(items: Sequence[T], parts: int) -> List[List[T]]:
+    """Split `items` into at most `parts` contiguous, near-equal runs."""
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    runs, start = [], 0
+    for i in range(parts):
+        end = start + size + (i < extra)
+        runs.append(list(items[start:end]))
+        start = end
+    return [run for run in runs if run]
+
+
+def process_pool(
+    workers: Optional[int] = None,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers or default_workers(),
+        mp_context=MP_CONTEXT,
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+def open_source(pdf: PdfSource) -> BinaryIO:
+    """A binary stream over `pdf`; the caller closes it, e.g. in a `with` block."""
+    return open(pdf, "rb") if isinstance(pdf, str) else BytesIO(pdf)
+
+
+def open_fitz(pdf: PdfSource):
+    import fitz  # PyMuPDF
+
+    if isinstance(pdf, str):
+        return fitz.open(pdf)
+    return fitz.open(stream=pdf, filetype="pdf")
+
+
+def source_size(pdf: PdfSource) -> int:
+    return os.path.getsize(pdf) if isinstance(pdf, str) else len(pdf)